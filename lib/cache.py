@@ -0,0 +1,168 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''on-disk cache of OCR results'''
+
+import errno
+import hashlib
+import json
+import os
+import threading
+import time
+
+from . import temporary
+from .engines import common
+
+def get_key(image, *params):
+    '''
+    Return a cache key for the image file and OCR parameters.
+    '''
+    hash = hashlib.sha1()
+    hash.update(json.dumps(params))
+    hash.update('\0')
+    image.seek(0)
+    while True:
+        chunk = image.read(1 << 16)
+        if not chunk:
+            break
+        hash.update(chunk)
+    image.seek(0)
+    return hash.hexdigest()
+
+class Cache(object):
+
+    '''
+    Content-addressed cache of OCR engine output.
+
+    Entries that were least recently used are removed when the cache grows
+    larger than max_size bytes.
+
+    The cache can be shared by many threads and processes. However, the size
+    limit is enforced only approximately: the cache directory is scanned only
+    once, so entries added later by other processes are not accounted for.
+    '''
+
+    def __init__(self, directory, max_size=None):
+        self._directory = directory
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(directory)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        # Sizes and access times of entries, keyed by path.
+        # The directory is scanned only when they are needed for the first time.
+        self._entries = None
+        self._size = 0
+
+    def _get_path(self, key):
+        return os.path.join(self._directory, key[:2], key[2:])
+
+    def _scan(self):
+        for root, dirs, files in os.walk(self._directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    # This entry is still being written.
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError as ex:
+                    # Another process might have removed the file.
+                    if ex.errno != errno.ENOENT:
+                        raise
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = dict(
+            (path, [size, mtime])
+            for path, size, mtime in self._scan()
+        )
+        self._size = sum(size for size, mtime in self._entries.itervalues())
+
+    def get(self, key):
+        '''
+        Return the cached Output, or None.
+        '''
+        path = self._get_path(key)
+        try:
+            file = open(path, 'rb')
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return None
+        with file:
+            format = file.readline().rstrip('\n')
+            contents = file.read()
+        try:
+            # Mark the entry as recently used.
+            os.utime(path, None)
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        with self._lock:
+            if self._entries is not None and path in self._entries:
+                self._entries[path][1] = time.time()
+        return common.Output(contents, format=format)
+
+    def put(self, key, output):
+        path = self._get_path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.mkdir(directory)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        data = '{fmt}\n{contents}'.format(fmt=output.format, contents=output)
+        with temporary.file(dir=directory, suffix='.tmp', delete=False) as file:
+            file.write(data)
+        # Renaming is atomic, so readers never see partially written entries.
+        os.rename(file.name, path)
+        if self._max_size is None:
+            return
+        with self._lock:
+            self._load()
+            old_entry = self._entries.get(path)
+            if old_entry is not None:
+                # The entry has been replaced (or found by the scan).
+                self._size -= old_entry[0]
+            self._entries[path] = [len(data), time.time()]
+            self._size += len(data)
+            if self._size > self._max_size:
+                self._evict()
+
+    def _evict(self):
+        # Make some room for new entries, so that eviction doesn't happen again
+        # on the very next put().
+        low_water_mark = self._max_size * 9 // 10
+        entries = sorted(self._entries.iteritems(), key=lambda item: item[1][1])
+        for path, (size, mtime) in entries:
+            if self._size <= low_water_mark:
+                break
+            try:
+                os.remove(path)
+            except OSError as ex:
+                if ex.errno != errno.ENOENT:
+                    raise
+            del self._entries[path]
+            self._size -= size
+
+__all__ = ['Cache', 'get_key']
+
+# vim:ts=4 sts=4 sw=4 et
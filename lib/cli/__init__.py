@@ -14,8 +14,10 @@
 # for more details.
 
 import argparse
+import sys
 
 from .. import errors
+from .. import utils
 
 class ArgumentParser(argparse.ArgumentParser):
 
@@ -24,4 +26,44 @@ class ArgumentParser(argparse.ArgumentParser):
             status = errors.EXIT_FATAL
         argparse.ArgumentParser.exit(self, status=status, message=message)
 
+    @staticmethod
+    def _read_file_list(file):
+        return [
+            line.rstrip('\n')
+            for line in file
+            if line.strip()
+        ]
+
+    def _merge_files_from(self, options):
+        '''
+        Add paths listed in the --files-from file to the ones given on the
+        command line. Error out if there are no paths at all.
+        '''
+        if options.files_from is not None:
+            try:
+                if options.files_from == '-':
+                    options.paths += self._read_file_list(sys.stdin)
+                else:
+                    with open(options.files_from, 'r') as file:
+                        options.paths += self._read_file_list(file)
+            except EnvironmentError as ex:
+                errors.fatal('cannot open {path!r}: {msg}'.format(
+                    path=ex.filename,
+                    msg=ex[1],
+                ))
+        if not options.paths:
+            self.error('no input files')
+
+def jobs(s):
+    '''
+    Parse the argument of -j/--jobs: a positive number, or "auto" for the
+    number of CPUs.
+    '''
+    if s == 'auto':
+        return utils.get_cpu_count()
+    n = int(s)
+    if n <= 0:
+        raise ValueError
+    return n
+
 # vim:ts=4 sts=4 sw=4 et
@@ -17,14 +17,19 @@ from __future__ import print_function
 
 import argparse
 import cgi
+import collections
+import io
 import locale
+import multiprocessing
 import os
 import re
 import sys
+import time
+import traceback
 
 from .. import cli
+from .. import errors
 from .. import hocr
-from .. import ipc
 from .. import logger
 from .. import temporary
 from .. import text_zones
@@ -32,10 +37,13 @@ from .. import unicode_support
 from .. import utils
 from .. import version
 
-from ..hocr import etree
 from ..text_zones import const
 from ..text_zones import sexpr
 
+# Import this after local modules, so that they can take care of a showing
+# a nice ImportError message.
+import djvu.decode
+
 __version__ = version.__version__
 
 system_encoding = locale.getpreferredencoding()
@@ -45,11 +53,12 @@ logger = logger.setup()
 class ArgumentParser(cli.ArgumentParser):
 
     def __init__(self):
-        usage = '%(prog)s [options] FILE'
+        usage = '%(prog)s [options] FILE\n       %(prog)s [options] {--output-dir=DIRECTORY | --output-template=TEMPLATE} [FILE...]'
         cli.ArgumentParser.__init__(self, usage=usage)
         self.add_argument('--version', action=version.VersionAction)
         group = self.add_argument_group(title='input selection options')
-        group.add_argument('path', metavar='FILE', help='DjVu file to covert')
+        group.add_argument('paths', metavar='FILE', nargs='*', help='DjVu file to covert')
+        group.add_argument('--files-from', dest='files_from', metavar='LIST', default=None, help='convert DjVu files listed in LIST (one per line)')
         def pages(x):
             return utils.parse_page_numbers(x)
         group.add_argument('-p', '--pages', dest='pages', action='store', default=None, type=pages, help='pages to convert')
@@ -60,65 +69,93 @@ class ArgumentParser(cli.ArgumentParser):
         group = self.add_argument_group(title='HTML output options')
         group.add_argument('--title', dest='title', help='document title', default='DjVu hidden text layer')
         group.add_argument('--css', metavar='STYLE', dest='css', help='CSS style', default='')
+        group = self.add_argument_group(title='output options')
+        group = group.add_mutually_exclusive_group()
+        group.add_argument('--output-dir', dest='output_dir', metavar='DIRECTORY', default=None, help='write hOCR of every FILE to DIRECTORY')
+        group.add_argument('--output-template', dest='output_template', metavar='TEMPLATE', default=None, help='write hOCR of every FILE to the file named by TEMPLATE')
+        self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=cli.jobs, default=1, help='start N worker processes')
 
     def parse_args(self, args=None, namespace=None):
         options = cli.ArgumentParser.parse_args(self, args, namespace)
-        if options.word_segmentation == 'uax29':
-            options.icu = icu = unicode_support.get_icu()
-            options.locale = icu.Locale(options.language)
-        else:
-            options.icu = None
-            options.locale = None
+        self._merge_files_from(options)
+        options.batch = options.output_dir is not None or options.output_template is not None
+        if len(options.paths) > 1 and not options.batch:
+            self.error('--output-dir or --output-template is required to convert multiple files')
+        if options.output_dir is not None and not os.path.isdir(options.output_dir):
+            self.error('{0!r} is not a directory'.format(options.output_dir))
+        if options.batch:
+            input_paths = {}
+            for path in options.paths:
+                try:
+                    output_path = get_output_path(path, options)
+                except (LookupError, ValueError) as ex:
+                    self.error('invalid output template: {0}'.format(ex))
+                key = os.path.normcase(os.path.abspath(output_path))
+                other_path = input_paths.setdefault(key, path)
+                if other_path != path:
+                    self.error('{0!r} and {1!r} would be both converted to {2!r}'.format(other_path, path, output_path))
+        setup_word_segmentation(options)
         return options
 
-class CharacterLevelDetails(Exception):
-    pass
-
-class Zone(object):
-
-    def __init__(self, sexpr, page_height):
-        self._sexpr = sexpr
-        self._page_height = page_height
+def setup_word_segmentation(options):
+    if options.word_segmentation == 'uax29':
+        options.icu = unicode_support.get_icu()
+        options.locale = unicode_support.get_locale(options.language)
+    else:
+        options.icu = None
+        options.locale = None
+    options.word_breaks = {}
 
-    @property
-    def type(self):
-        return const.get_text_zone_type(self._sexpr[0].value)
+def get_output_path(path, options):
+    '''
+    Return path of the file to write hOCR of the DjVu file to.
+    '''
+    dirname, basename = os.path.split(path)
+    stem = os.path.splitext(basename)[0]
+    if options.output_dir is not None:
+        return os.path.join(options.output_dir, stem + '.html')
+    return options.output_template.format(
+        dirname=(dirname or os.curdir),
+        basename=basename,
+        stem=stem,
+    )
 
-    @property
-    def bbox(self):
-        return text_zones.BBox(
-            self._sexpr[1].value,
-            self._page_height - self._sexpr[4].value,
-            self._sexpr[3].value,
-            self._page_height - self._sexpr[2].value,
-        )
+def get_zone_type(zone):
+    return const.get_text_zone_type(zone[0])
 
-    @property
-    def text(self):
-        if len(self._sexpr) != 6:
-            raise TypeError('list of {0} (!= 6) elements'.format(len(self._sexpr)))  # no coverage
-        if not isinstance(self._sexpr[5], sexpr.StringExpression):
-            raise TypeError('last element is not a string')  # no coverage
-        return unicode(self._sexpr[5].value, 'UTF-8', 'replace')
-
-    @property
-    def children(self):
-        for child in self._sexpr[5:]:
-            if isinstance(child, sexpr.ListExpression):
-                yield Zone(child, self._page_height)
-            else:
-                yield self.text
-                return
+def get_zone_bbox(zone, page_height):
+    '''
+    Return bounding box of the zone, with the origin in the top-left corner.
+    '''
+    return text_zones.BBox(
+        zone[1],
+        page_height - zone[4],
+        zone[3],
+        page_height - zone[2],
+    )
 
-    @property
-    def n_children(self):
-        n = len(self._sexpr) - 5
-        if n <= 0:
-            raise TypeError('list of {0} (< 6) elements'.format(len(self._sexpr)))  # no coverage
-        return n
+def get_zone_text(zone):
+    if len(zone) != 6:
+        raise TypeError('list of {0} (!= 6) elements'.format(len(zone)))  # no coverage
+    text = zone[5]
+    if not isinstance(text, str) or isinstance(text, sexpr.Symbol):
+        raise TypeError('last element is not a string')  # no coverage
+    return unicode(text, 'UTF-8', 'replace')
 
-    def __repr__(self):
-        return '{tp}({sexpr!r})'.format(tp=type(self).__name__, sexpr=self._sexpr)
+def get_zone_children(zone):
+    '''
+    Return list of child zones, or list of just the zone text.
+    '''
+    if len(zone) < 6:
+        raise TypeError('list of {0} (< 6) elements'.format(len(zone)))  # no coverage
+    children = []
+    for child in zone[5:]:
+        if isinstance(child, tuple):
+            children += [child]
+        else:
+            children += [get_zone_text(zone)]
+            break
+    return children
 
 _xml_string_re = re.compile(
     u'''
@@ -128,29 +165,72 @@ _xml_string_re = re.compile(
     re.VERBOSE
 )
 
-def set_text(element, text):
-    last = None
+_xml_control_char_re = re.compile(u'[\x00-\x08\x0B\x0C\x0E-\x1F]')
+
+def _escape_xml_text(text):
+    return (text
+        .replace('&', '&amp;')
+        .replace('<', '&lt;')
+        .replace('>', '&gt;')
+        .replace('\r', '&#13;')
+    )
+
+def format_text(text):
+    '''
+    Return XML markup for the text. Characters that are not allowed in XML
+    are replaced with <span class="djvu_char"> elements.
+    '''
+    if _xml_control_char_re.search(text) is None:
+        return _escape_xml_text(text)
+    chunks = []
     for match in _xml_string_re.finditer(text):
-        if match.group(1):
-            if last is None:
-                element.text = match.group(1)
-            else:
-                last.tail = match.group(1)
+        chunks += [_escape_xml_text(match.group(1))]
         if match.group(2):
-            last = etree.Element('span')
-            last.set('class', 'djvu_char')
-            last.set('title', '#x{0:02x}'.format(ord(match.group(2))))
-            last.text = ' '
-            element.append(last)
+            chunks += [u'<span class="djvu_char" title="#x{0:02x}"> </span>'.format(ord(match.group(2)))]
+    return u''.join(chunks)
+
+def format_bbox(bbox):
+    return str.join(' ', map(str, bbox))
 
-def break_chars(char_zone_list, options):
+def format_word(title, text):
+    text = format_text(text)
+    if not text:
+        return u'<span class="ocrx_word" title="{title}"/>'.format(title=title)
+    return u'<span class="ocrx_word" title="{title}">{text}</span>'.format(title=title, text=text)
+
+def get_word_breaks(text, options):
+    try:
+        return options.word_breaks[text]
+    except KeyError:
+        return unicode_support.word_break_iterator(text, options.locale)
+
+def iter_texts_to_break(zone, top=True):
+    '''
+    Yield texts that write_zone() would segment into words.
+    '''
+    zone_type = get_zone_type(zone)
+    children = get_zone_children(zone)
+    for child in children:
+        if isinstance(child, tuple):
+            if get_zone_type(child) == const.TEXT_ZONE_CHARACTER:
+                yield str.join('', (get_zone_text(char_zone) for char_zone in children))
+                return
+            for text in iter_texts_to_break(child, top=False):
+                yield text
+        elif zone_type >= const.TEXT_ZONE_WORD and not top:
+            yield child
+
+def break_chars(char_zones, page_height, options):
+    '''
+    Return list of [markup, tail] pairs for words made of the characters.
+    '''
     bbox_list = []
     text = []
-    for char_zone in char_zone_list:
-        bbox = char_zone.bbox
-        char_text = char_zone.text
+    for char_zone in char_zones:
+        char_text = get_zone_text(char_zone)
         if not char_text:
             continue
+        bbox = get_zone_bbox(char_zone, page_height)
         for i, char in enumerate(char_text):
             subbox = text_zones.BBox(
                 int(bbox.x0 + (bbox.x1 - bbox.x0) * 1.0 * i / len(char_text) + 0.5),
@@ -161,38 +241,37 @@ def break_chars(char_zone_list, options):
             bbox_list += [subbox]
         text += [char_text]
     text = str.join('', text)
-    break_iterator = unicode_support.word_break_iterator(text, options.locale)
-    element = None
+    words = []
     i = 0
-    for j in break_iterator:
+    for j in get_word_breaks(text, options):
         subtext = text[i:j]
         if subtext.isspace():
-            if element is not None:
-                element.tail = ' '
+            if words:
+                words[-1][1] = ' '
             i = j
             continue
         bbox = text_zones.BBox()
         for k in xrange(i, j):
             bbox.update(bbox_list[k])
-        element = etree.Element('span')
-        element.set('class', 'ocrx_word')
-        element.set('title', 'bbox {bbox}; bboxes {bboxes}'.format(
-            bbox=str.join(' ', map(str, bbox)),
-            bboxes=str.join(', ', (str.join(' ', map(str, bbox)) for bbox in bbox_list[i:j]))
-        ))
-        set_text(element, subtext)
-        yield element
+        title = 'bbox {bbox}; bboxes {bboxes}'.format(
+            bbox=format_bbox(bbox),
+            bboxes=str.join(', ', (format_bbox(bbox) for bbox in bbox_list[i:j])),
+        )
+        words += [[format_word(title, subtext), None]]
         i = j
+    return words
 
 def break_plain_text(text, bbox, options):
-    break_iterator = unicode_support.word_break_iterator(text, options.locale)
+    '''
+    Return list of [markup, tail] pairs for words of the text.
+    '''
+    words = []
     i = 0
-    element = None
-    for j in break_iterator:
+    for j in get_word_breaks(text, options):
         subtext = text[i:j]
         if subtext.isspace():
-            if element is not None:
-                element.tail = ' '
+            if words:
+                words[-1][1] = ' '
             i = j
             continue
         subbox = text_zones.BBox(
@@ -201,73 +280,77 @@ def break_plain_text(text, bbox, options):
             int(bbox.x0 + (bbox.x1 - bbox.x0) * 1.0 * j / len(text) + 0.5),
             bbox.y1,
         )
-        element = etree.Element('span')
-        element.set('class', 'ocrx_word')
-        element.set('title', 'bbox ' + str.join(' ', map(str, subbox)))
-        set_text(element, subtext)
-        yield element
+        words += [[format_word('bbox ' + format_bbox(subbox), subtext), None]]
         i = j
+    return words
 
-def process_zone(parent, zone, last, options):
-    zone_type = zone.type
-    if zone_type <= const.TEXT_ZONE_LINE and parent is not None:
-        parent.tail = '\n'
-    try:
-        hocr_tag, hocr_class = hocr.djvu_zone_to_hocr(zone_type)
-    except LookupError as ex:
-        if ex[0] == const.TEXT_ZONE_CHARACTER:
-            raise CharacterLevelDetails
-        raise
-    self = etree.Element(hocr_tag)
-    self.set('class', hocr_class)
-    if zone_type == const.TEXT_ZONE_PAGE:
+def write_zone(output, zone, page_height, last, options, top=False):
+    '''
+    Append hOCR markup for the zone to the output list.
+
+    Return text that should follow the markup, or None if the zone was
+    replaced with words (which are followed by their own text).
+    '''
+    zone_type = get_zone_type(zone)
+    children = get_zone_children(zone)
+    if top:
         bbox = options.page_bbox
     else:
-        bbox = zone.bbox
-    self.set('title', 'bbox ' + str.join(' ', map(str, bbox)))
-    n_children = zone.n_children
-    character_level_details = False
-    for n, child_zone in enumerate(zone.children):
-        last_child = n == n_children - 1
-        if isinstance(child_zone, Zone):
-            try:
-                process_zone(self, child_zone, last=last_child, options=options)
-            except CharacterLevelDetails:
-                # Do word segmentation by hand.
-                character_level_details = True
-                break
-    if character_level_details:
-        # Do word segmentation by hand.
-        child = None
-        for child in break_chars(zone.children, options):
-            parent.append(child)
-        if child is not None and zone_type == const.TEXT_ZONE_WORD and not last:
-            child.tail = ' '
-        self = None
-    elif isinstance(child_zone, unicode):
-        text = child_zone
-        if zone_type >= const.TEXT_ZONE_WORD and options.icu is not None and parent is not None:
+        bbox = get_zone_bbox(zone, page_height)
+    words = None
+    if isinstance(children[0], tuple):
+        if any(get_zone_type(child) == const.TEXT_ZONE_CHARACTER for child in children):
             # Do word segmentation by hand.
-            child = None
-            for child in break_plain_text(text, bbox, options):
-                parent.append(child)
-            if child is not None and zone_type == const.TEXT_ZONE_WORD and not last:
-                child.tail = ' '
-            self = None
-        else:
-            # Word segmentation as provided by DjVu.
-            # There's no point in doing word segmentation if only line coordinates are provided.
-            set_text(self, text)
-            if zone_type == const.TEXT_ZONE_WORD and not last:
-                self.tail = ' '
-    if parent is not None and self is not None:
-        parent.append(self)
-    return self
-
-def process_page(page_text, options):
-    result = process_zone(None, page_text, last=True, options=options)
-    tree = etree.ElementTree(result)
-    tree.write(sys.stdout, encoding='UTF-8')
+            words = break_chars(children, page_height, options)
+    elif zone_type >= const.TEXT_ZONE_WORD and options.icu is not None and not top:
+        # Do word segmentation by hand.
+        words = break_plain_text(children[0], bbox, options)
+    if words is not None:
+        if words and zone_type == const.TEXT_ZONE_WORD and not last:
+            words[-1][1] = ' '
+        for markup, tail in words:
+            output += [markup]
+            if tail:
+                output += [tail]
+        return
+    hocr_tag, hocr_class = hocr.djvu_zone_to_hocr(zone_type)
+    output += [u'<{tag} class="{cls}" title="bbox {bbox}"'.format(tag=hocr_tag, cls=hocr_class, bbox=format_bbox(bbox))]
+    # Elements without contents are written as <tag/>.
+    n = len(output)
+    output += ['>']
+    tail = None
+    if isinstance(children[0], tuple):
+        last_n = len(children) - 1
+        for n_child, child in enumerate(children):
+            child_tail = write_zone(output, child, page_height, last=(n_child == last_n), options=options)
+            if child_tail:
+                output += [child_tail]
+            if get_zone_type(child) <= const.TEXT_ZONE_LINE:
+                tail = '\n'
+    else:
+        # Word segmentation as provided by DjVu.
+        # There's no point in doing word segmentation if only line coordinates are provided.
+        text = format_text(children[0])
+        if text:
+            output += [text]
+        if zone_type == const.TEXT_ZONE_WORD and not last:
+            tail = ' '
+    if len(output) == n + 1:
+        output[n] = '/>'
+    else:
+        output += [u'</{tag}>'.format(tag=hocr_tag)]
+    return tail
+
+def process_page(page_text, options, file):
+    if options.icu is not None:
+        # Segment text of the whole page at once.
+        texts = list(iter_texts_to_break(page_text))
+        options.word_breaks = dict(zip(texts, unicode_support.word_breaks(texts, options.locale)))
+    output = []
+    tail = write_zone(output, page_text, options.page_bbox.y1, last=True, options=options, top=True)
+    if tail:
+        output += [tail]
+    file.write(u''.join(output).encode('UTF-8'))
 
 hocr_header_template = '''\
 <?xml version="1.0" encoding="UTF-8"?>
@@ -290,28 +373,52 @@ hocr_footer = '''
 </html>
 '''
 
-def main(argv=sys.argv):
-    options = ArgumentParser().parse_args(argv[1:])
-    logger.info('Converting {path}:'.format(path=utils.smart_repr(options.path, system_encoding)))
-    if options.pages is None:
-        djvused = ipc.Subprocess(
-            ['djvused', '-e', 'n', os.path.abspath(options.path)],
-            stdout=ipc.PIPE,
-        )
-        try:
-            n_pages = int(djvused.stdout.readline())
-        finally:
-            djvused.wait()
-        options.pages = xrange(1, n_pages + 1)
-    page_iterator = iter(options.pages)
-    sed_script = temporary.file(suffix='.djvused')
-    for n in options.pages:
-        print('select {0}; size; print-txt'.format(n), file=sed_script)
-    sed_script.flush()
-    djvused = ipc.Subprocess(
-        ['djvused', '-f', sed_script.name, os.path.abspath(options.path)],
-        stdout=ipc.PIPE,
-    )
+class Context(djvu.decode.Context):
+
+    def handle_message(self, message):
+        if isinstance(message, djvu.decode.ErrorMessage):
+            logger.warning(message)
+
+def open_document(path):
+    context = Context()
+    document = context.new_document(djvu.decode.FileURI(path))
+    document.decoding_job.wait()
+    if issubclass(document.decoding_job.status, djvu.decode.JobFailed):
+        raise document.decoding_job.status
+    return document
+
+def get_page_text(page):
+    '''
+    Return the page size and the hidden text of the page (or None), in the
+    coordinates of the unrotated page.
+    '''
+    page.get_info(wait=True)
+    width, height = page.size
+    if page.rotation in (90, 270):
+        # Page info takes the initial rotation into account,
+        # but the text layer doesn't.
+        width, height = height, width
+    page.text.wait()
+    page_text = page.text.sexpr
+    if not page_text:
+        page_text = None
+    return (width, height), page_text
+
+def convert_page(page, options):
+    '''
+    Return hOCR of the page (or an empty string, if the page has no hidden
+    text).
+    '''
+    page_size, page_text = get_page_text(page)
+    if page_text is None:
+        # There's no hidden text to convert.
+        return ''
+    options.page_bbox = text_zones.BBox(0, 0, page_size[0], page_size[1])
+    file = io.BytesIO()
+    process_page(page_text.value, options, file)
+    return file.getvalue()
+
+def get_hocr_header(options):
     ocr_system = 'djvu2hocr {ver}'.format(ver=__version__)
     hocr_header = hocr_header_template.format(
         ocr_system=ocr_system,
@@ -321,21 +428,175 @@ def main(argv=sys.argv):
     )
     if not options.css:
         hocr_header = re.sub(hocr_header_style_re, '', hocr_header, count=1)
-    sys.stdout.write(hocr_header)
-    for n in page_iterator:
+    return hocr_header
+
+def get_page_numbers(document, options):
+    if options.pages is None:
+        return xrange(1, len(document.pages) + 1)
+    return options.pages
+
+def _get_worker_options(options):
+    # ICU objects cannot be pickled,
+    # so every worker process sets up word segmentation on its own.
+    options = argparse.Namespace(**vars(options))
+    del options.icu, options.locale, options.word_breaks
+    return options
+
+_worker_options = None
+_worker_document = None
+
+def _init_worker(options, path=None):
+    global _worker_options, _worker_document
+    setup_word_segmentation(options)
+    _worker_options = options
+    if path is not None:
+        # DjVu documents cannot be pickled either.
+        _worker_document = open_document(path)
+
+def _convert_pages_in_worker(numbers):
+    return str.join('', (
+        convert_page(_worker_document.pages[n - 1], _worker_options)
+        for n in numbers
+    ))
+
+def convert_pages_parallel(path, options):
+    '''
+    Convert chunks of pages in a pool of worker processes. Yield pairs of page
+    numbers and their hOCR, in the original order.
+    '''
+    n_jobs = options.n_jobs
+    pages = list(options.pages)
+    # Bigger chunks mean less communication between processes, but there
+    # should be enough of them to keep all the workers busy.
+    chunk_size = max(1, min(16, len(pages) // (4 * n_jobs)))
+    pool = multiprocessing.Pool(n_jobs, _init_worker, (_get_worker_options(options), path))
+    try:
+        results = collections.deque()
+        for i in xrange(0, len(pages), chunk_size):
+            while len(results) >= 2 * n_jobs:
+                # Don't let the converted pages pile up in memory.
+                numbers, result = results.popleft()
+                yield numbers, result.get()
+            numbers = pages[i:(i + chunk_size)]
+            results.append((numbers, pool.apply_async(_convert_pages_in_worker, (numbers,))))
+        while results:
+            numbers, result = results.popleft()
+            yield numbers, result.get()
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def convert_document(path, options):
+    '''
+    Convert the DjVu file to the hOCR file named by the output options.
+
+    Return tuple of the path, the number of converted pages, the time it
+    took, and the formatted traceback (or None, if the conversion was
+    successful).
+    '''
+    start = time.time()
+    n_pages = 0
+    try:
+        document = open_document(path)
+        output_path = get_output_path(path, options)
+        # Write to a temporary file first, so that failed conversions don't
+        # leave partial output behind. The file is created next to the output
+        # file, so that it can be renamed, and its name is unique, so that
+        # it doesn't clash with other ocrodjvu processes.
+        file = temporary.file(
+            dir=(os.path.dirname(output_path) or os.curdir),
+            prefix=(os.path.basename(output_path) + '.'),
+            suffix='.tmp',
+            delete=False,
+        )
         try:
-            page_size = [
-                int(str(sexpr.Expression.from_stream(djvused.stdout).value).split('=')[1])
-                for i in xrange(2)
-            ]
-            options.page_bbox = text_zones.BBox(0, 0, page_size[0], page_size[1])
-            page_text = sexpr.Expression.from_stream(djvused.stdout)
-        except sexpr.ExpressionSyntaxError:
-            break
-        logger.info('- Page #{n}'.format(n=n))
-        page_zone = Zone(page_text, page_size[1])
-        process_page(page_zone, options)
+            with file:
+                # Temporary files are created with 0600 permissions;
+                # give the output file the usual ones.
+                os.fchmod(file.fileno(), 0o666 & ~get_umask())
+                file.write(get_hocr_header(options))
+                for n in get_page_numbers(document, options):
+                    file.write(convert_page(document.pages[n - 1], options))
+                    n_pages += 1
+                file.write(hocr_footer)
+            os.rename(file.name, output_path)
+        except:
+            os.remove(file.name)
+            raise
+    except (SystemExit, KeyboardInterrupt):
+        raise
+    except Exception:
+        return path, n_pages, time.time() - start, traceback.format_exc()
+    return path, n_pages, time.time() - start, None
+
+def _convert_document_in_worker(path):
+    return convert_document(path, _worker_options)
+
+def convert_documents(options):
+    '''
+    Convert every DjVu file, in a pool of worker processes if requested.
+    Yield the results of convert_document(), in the order of completion.
+    '''
+    if options.n_jobs == 1 or len(options.paths) == 1:
+        for path in options.paths:
+            yield convert_document(path, options)
+        return
+    n_jobs = min(options.n_jobs, len(options.paths))
+    # The workers are reused for many documents,
+    # so modules are imported and ICU is set up only once per worker.
+    pool = multiprocessing.Pool(n_jobs, _init_worker, (_get_worker_options(options),))
+    try:
+        for result in pool.imap_unordered(_convert_document_in_worker, options.paths):
+            yield result
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+def main_batch(options):
+    start = time.time()
+    n_failed = 0
+    for path, n_pages, seconds, tb in convert_documents(options):
+        path = utils.smart_repr(path, system_encoding)
+        if tb is None:
+            logger.info('Converted {path}: {n} page(s) in {t:.2f} s'.format(path=path, n=n_pages, t=seconds))
+        else:
+            n_failed += 1
+            message = 'Exception while converting {path} (after {t:.2f} s):\n{tb}'.format(path=path, t=seconds, tb=tb)
+            logger.error(message.rstrip())
+    logger.info('Converted {n} of {total} file(s) in {t:.2f} s'.format(
+        n=(len(options.paths) - n_failed),
+        total=len(options.paths),
+        t=(time.time() - start),
+    ))
+    if n_failed:
+        sys.exit(errors.EXIT_NONFATAL)
+
+def main(argv=sys.argv):
+    options = ArgumentParser().parse_args(argv[1:])
+    if options.batch:
+        main_batch(options)
+        return
+    [path] = options.paths
+    logger.info('Converting {path}:'.format(path=utils.smart_repr(path, system_encoding)))
+    document = open_document(path)
+    options.pages = get_page_numbers(document, options)
+    sys.stdout.write(get_hocr_header(options))
+    if options.n_jobs > 1:
+        for numbers, result in convert_pages_parallel(path, options):
+            for n in numbers:
+                logger.info('- Page #{n}'.format(n=n))
+            sys.stdout.write(result)
+    else:
+        for n in options.pages:
+            logger.info('- Page #{n}'.format(n=n))
+            sys.stdout.write(convert_page(document.pages[n - 1], options))
     sys.stdout.write(hocr_footer)
-    djvused.wait()
 
 # vim:ts=4 sts=4 sw=4 et
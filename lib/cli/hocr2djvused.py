@@ -14,11 +14,13 @@
 # for more details.
 
 import argparse
+import collections
+import io
+import multiprocessing
 import sys
 
 from .. import cli
 from .. import hocr
-from .. import text_zones
 from .. import version
 
 __version__ = version.__version__
@@ -45,6 +47,7 @@ class ArgumentParser(cli.ArgumentParser):
         group.add_argument('-l', '--language', dest='language', help=argparse.SUPPRESS or 'language for word segmentation', default='eng')
         self.add_argument('--html5', dest='html5', action='store_true', help='use HTML5 parser')
         self.add_argument('--fix-utf8', dest='fix_utf8', action='store_true', help='attempt to fix UTF-8 encoding issues')
+        self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=cli.jobs, default=1, help='start N worker processes')
         self.add_argument('input_files', metavar='FILE', nargs='*', type=argparse.FileType('r'), default=[sys.stdin], help='hOCR file to parse (default: standard input)')
 
     def parse_args(self, args=None, namespace=None):
@@ -56,24 +59,81 @@ class ArgumentParser(cli.ArgumentParser):
         del options.word_segmentation
         return options
 
+def get_extract_options(options):
+    return dict(
+        rotation=options.rotation,
+        details=options.details,
+        uax29=options.uax29,
+        html5=options.html5,
+        fix_utf8=options.fix_utf8,
+        page_size=options.page_size,
+    )
+
+def format_text(zone):
+    file = io.BytesIO()
+    zone.print_into(file, width=80)
+    return file.getvalue()
+
 def get_texts(options):
+    kwargs = get_extract_options(options)
     for file in options.input_files:
-        texts = hocr.extract_text(file,
-            rotation=options.rotation,
-            details=options.details,
-            uax29=options.uax29,
-            html5=options.html5,
-            fix_utf8=options.fix_utf8,
-            page_size=options.page_size,
-        )
-        for text in texts:
-            yield text
+        zones = hocr.iter_zones(file, **kwargs)
+        for zone in zones:
+            yield format_text(zone)
+
+_worker_kwargs = None
+
+def _init_worker(kwargs):
+    # Text zone types cannot be pickled, so the options are passed only
+    # once, when the worker process is created.
+    global _worker_kwargs
+    _worker_kwargs = kwargs
+
+def _get_texts_in_worker(document):
+    return [
+        format_text(zone)
+        for zone in hocr.iter_zones(io.BytesIO(document), **_worker_kwargs)
+    ]
+
+def get_texts_parallel(options):
+    '''
+    Like get_texts(), but process pages in parallel.
+
+    Input files are split into single-page documents, which are given to a
+    pool of worker processes. The results are collected in the original order.
+    '''
+    kwargs = get_extract_options(options)
+    n_jobs = options.n_jobs
+    pool = multiprocessing.Pool(n_jobs, _init_worker, (kwargs,))
+    try:
+        results = collections.deque()
+        for file in options.input_files:
+            for document in hocr.split_document(file, **kwargs):
+                while len(results) >= 2 * n_jobs:
+                    # Don't let the documents pile up in memory.
+                    for text in results.popleft().get():
+                        yield text
+                results.append(pool.apply_async(_get_texts_in_worker, (document,)))
+        while results:
+            for text in results.popleft().get():
+                yield text
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
 
 def main(argv=sys.argv):
     options = ArgumentParser().parse_args(argv[1:])
-    for i, text in enumerate(get_texts(options)):
+    if options.n_jobs > 1:
+        texts = get_texts_parallel(options)
+    else:
+        texts = get_texts(options)
+    for i, text in enumerate(texts):
         sys.stdout.write('select {0}\nremove-txt\nset-txt\n'.format(i + 1))
-        text_zones.print_sexpr(text, sys.stdout, width=80)
+        sys.stdout.write(text)
         sys.stdout.write('\n.\n\n')
+        # Let the consumer process this page while the next one is being
+        # parsed.
+        sys.stdout.flush()
 
 # vim:ts=4 sts=4 sw=4 et
@@ -16,21 +16,31 @@
 from __future__ import print_function
 
 import argparse
+import collections
 import contextlib
+import errno
+import hashlib
 import inspect
+import io
+import json
 import locale
+import multiprocessing
 import os.path
+import Queue as queue
 import shutil
 import string
 import sys
 import threading
 import traceback
 
+from .. import cache
 from .. import cli
 from .. import engines
 from .. import errors
 from .. import ipc
 from .. import logger
+from .. import probes
+from .. import stats
 from .. import temporary
 from .. import text_zones
 from .. import utils
@@ -65,6 +75,69 @@ class Saver(object):
     def save(self, document, pages, djvu_path, sed_file):
         raise NotImplementedError('Cannot save results in this format')  # no coverage
 
+    def open_stream(self, document, pages, djvu_path):
+        '''
+        Start saving results before the djvused script is complete.
+
+        Return a DjvusedStream, or None if this saver cannot do that.
+        '''
+        return None
+
+class DjvusedStream(object):
+
+    '''
+    djvused process that runs the script as it is being written
+    '''
+
+    def __init__(self, djvu_path):
+        # Without -s, the document is saved only by the explicit “save”
+        # command at the end of the script. If ocrodjvu dies in the middle,
+        # djvused sees an incomplete script and leaves the file alone.
+        self._djvused = ipc.Subprocess(
+            ['djvused', os.path.abspath(djvu_path)],
+            stdin=ipc.PIPE,
+        )
+
+    def _feed(self, method, *args):
+        try:
+            method(*args)
+        except IOError as ex:
+            if ex.errno != errno.EPIPE:
+                raise
+            # djvused exited prematurely. Report its exit status instead.
+            self._djvused.stdin = None
+            self._djvused.wait()
+            raise
+
+    def write(self, data):
+        self._feed(self._djvused.stdin.write, data)
+
+    def flush(self):
+        self._feed(self._djvused.stdin.flush)
+
+    def close(self):
+        self._feed(self._djvused.stdin.write, 'save\n')
+        self._feed(self._djvused.stdin.close)
+        self._djvused.wait()
+
+    def abort(self):
+        if self._djvused.returncode is not None:
+            return
+        self._djvused.kill()
+        try:
+            self._djvused.wait()
+        except ipc.CalledProcessError:
+            pass
+
+class TeeFile(object):
+
+    def __init__(self, *files):
+        self._files = files
+
+    def write(self, data):
+        for file in self._files:
+            file.write(data)
+
 class BundledSaver(Saver):
 
     '''save results as a bundled multi-page document'''
@@ -86,6 +159,14 @@ class BundledSaver(Saver):
             file.close()
         self._ips.save(None, pages, self._save_path, sed_file)
 
+    def open_stream(self, document, pages, djvu_path):
+        file = open(self._save_path, 'wb')
+        try:
+            document.save(file=file, pages=pages)
+        finally:
+            file.close()
+        return self._ips.open_stream(None, pages, self._save_path)
+
 class IndirectSaver(Saver):
 
     '''save results as an indirect multi-page document'''
@@ -103,6 +184,10 @@ class IndirectSaver(Saver):
         document.save(indirect=self._save_path, pages=pages)
         self._ips.save(None, pages, self._save_path, sed_file)
 
+    def open_stream(self, document, pages, djvu_path):
+        document.save(indirect=self._save_path, pages=pages)
+        return self._ips.open_stream(None, pages, self._save_path)
+
 class ScriptSaver(Saver):
 
     '''save a djvused script with results'''
@@ -133,6 +218,9 @@ class InPlaceSaver(Saver):
         )
         djvused.wait()
 
+    def open_stream(self, document, pages, djvu_path):
+        return DjvusedStream(djvu_path)
+
 class DryRunSaver(Saver):
 
     '''don't change any files'''
@@ -210,6 +298,7 @@ class HelpFormatter(argparse.HelpFormatter):
             act for act in orig_actions
             if (
                 act.required or
+                not act.option_strings or
                 isinstance(act, ArgumentParser.set_output)
             )
         ]
@@ -252,6 +341,7 @@ class ArgumentParser(cli.ArgumentParser):
             )
         group.add_argument('--ocr-only', dest='ocr_only', action='store_true', default=False, help='''don't save pages without OCR''')
         group.add_argument('--clear-text', dest='clear_text', action='store_true', default=False, help='remove existing hidden text')
+        group.add_argument('--stream-save', dest='stream_save', action='store_true', default=False, help='run djvused while pages are being processed')
         group.add_argument('--save-raw-ocr', dest='save_raw_ocr_dir', metavar='DIRECTORY', help='save raw OCR output')
         group.add_argument('--raw-ocr-filename-template', metavar='TEMPLATE', default='{id-ext}', help='file naming scheme for raw OCR')
         self.add_argument('-e', '--engine', dest='engine', choices=self.engines, metavar='ENGINE', help='OCR engine to use (default: {0})'.format(self.engines.default))
@@ -262,15 +352,24 @@ class ArgumentParser(cli.ArgumentParser):
         def pages(x):
             return utils.parse_page_numbers(x)
         self.add_argument('-p', '--pages', dest='pages', action='store', default=None, type=pages, help='pages to process')
-        def jobs(s):
-            if s == 'auto':
-                return utils.get_cpu_count()
+        self.add_argument('--skip-existing-text', dest='skip_existing_text', action='store_true', default=False, help='''don't process pages that already have hidden text''')
+        self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=cli.jobs, default=1, help='start N OCR threads')
+        self.add_argument('--workers', dest='workers', choices=('thread', 'process'), default='thread', help='where to render pages and parse OCR results')
+        def positive_int(s):
             n = int(s)
             if n <= 0:
                 raise ValueError
             return n
-        self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=jobs, default=1, help='start N OCR threads')
-        self.add_argument('path', metavar='FILE', help='DjVu file to process')
+        self.add_argument('--max-inflight', dest='max_inflight', metavar='N', type=positive_int, default=None, help='process at most N pages ahead of the first unsaved one')
+        self.add_argument('--batch-size', dest='batch_size', metavar='N', type=positive_int, default=1, help='let the OCR engine recognize N pages at once')
+        def size(s):
+            n = utils.parse_size(s)
+            if n < 0:
+                raise ValueError
+            return n
+        self.add_argument('--memory-budget', dest='memory_budget', metavar='SIZE', type=size, default=None, help='move OCR results to disk when they take more memory than SIZE')
+        self.add_argument('paths', metavar='FILE', nargs='*', help='DjVu file to process')
+        self.add_argument('--files-from', dest='files_from', metavar='LIST', default=None, help='process DjVu files listed in LIST (one per line)')
         group = self.add_argument_group(title='text segmentation options')
         group.add_argument('-t', '--details', dest='details', choices=('lines', 'words', 'chars'), action='store', default='words', help='amount of text details to extract')
         group.add_argument('--word-segmentation', dest='word_segmentation', choices=('simple', 'uax29'), default='simple', help='word segmentation algorithm')
@@ -279,16 +378,30 @@ class ArgumentParser(cli.ArgumentParser):
         group.add_argument('-X', dest='properties', metavar='KEY=VALUE', help='set an engine-specific property', action='append', default=[])
         group.add_argument('--on-error', choices=('abort', 'resume'), default='abort', help='error handling strategy')
         group.add_argument('--html5', dest='html5', action='store_true', help='use HTML5 parser')
+        group.add_argument('--cache-dir', dest='cache_dir', metavar='DIRECTORY', default=None, help='cache OCR results in DIRECTORY')
+        group.add_argument('--cache-size', dest='cache_size', metavar='SIZE', type=size, default='1G', help='remove least recently used OCR results when the cache is larger than SIZE (default: 1G)')
+        group.add_argument('--stats', dest='stats_path', metavar='FILE', default=None, help='write timings of processing stages to FILE')
+        group.add_argument('--stats-prometheus', dest='stats_prometheus_path', metavar='FILE', default=None, help='write summary of timings to FILE in the Prometheus text format')
+        group.add_argument('--resume', dest='journal_path', metavar='JOURNAL', default=None, help='reuse OCR results recorded in JOURNAL, and record new ones there')
 
     class list_engines(argparse.Action):
         def __call__(self, parser, namespace, values, option_string=None):
-            for ename in parser.engines:
-                engine = parser.engines[ename]
+            def is_available(engine):
                 try:
-                    engine = engine()
+                    engine()
                 except errors.EngineNotFound:
-                    pass
+                    return False
                 else:
+                    return True
+            enames = list(parser.engines)
+            # Probing each engine takes a while,
+            # so let's probe all of them at the same time.
+            available = probes.run_parallel(
+                lambda engine=parser.engines[ename]: is_available(engine)
+                for ename in enames
+            )
+            for ename, ok in zip(enames, available):
+                if ok:
                     print(ename)
             sys.exit(0)
 
@@ -318,6 +431,19 @@ class ArgumentParser(cli.ArgumentParser):
         options.details = self._details_map[options.details]
         options.render_layers = self._render_map[options.render_layers]
         options.resume_on_error = options.on_error == 'resume'
+        self._merge_files_from(options)
+        if options.stats_path is not None:
+            try:
+                open(options.stats_path, 'wb').close()
+            except EnvironmentError as ex:
+                errors.fatal('cannot open {path!r}: {msg}'.format(
+                    path=ex.filename,
+                    msg=ex[1],
+                ))
+        if options.clear_text and options.skip_existing_text:
+            self.error('--clear-text and --skip-existing-text are mutually exclusive')
+        if len(options.paths) > 1 and options.saver.get_n_args() > 0:
+            self.error('cannot save results for multiple input files into a single file')
         try:
             options.saver.check()
         except OSError as exc:
@@ -385,23 +511,369 @@ class ArgumentParser(cli.ArgumentParser):
             options.n_jobs = utils.get_cpu_count()
         return options
 
-class Results(dict):
+class PageFuture(object):
+
+    '''
+    Result of processing a page: page text, False (if there was no image
+    suitable for OCR), or an exception.
+    '''
+
+    def __init__(self, job, page):
+        self.job = job
+        self.page = page
+        self._result = None
+        self._done = threading.Event()
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def result(self):
+        self._done.wait()
+        return self._result
+
+class Scheduler(object):
+
+    '''
+    Work queue shared by the worker threads.
+    '''
+
     seen_exception = False
 
-    def __missing__(self, key):
-        return
+    def __init__(self, njobs, memory_budget=None, max_inflight=None):
+        self._njobs = njobs
+        self._queue = queue.Queue()
+        self._memory_budget = memory_budget
+        self._max_inflight = max_inflight
+        # Number of bytes of page texts held in memory:
+        self._size = 0
+        self._size_lock = threading.Lock()
+
+    def submit(self, job, pages):
+        '''
+        Submit a batch of pages of the same document.
+        '''
+        futures = [PageFuture(job, page) for page in pages]
+        self._queue.put(futures)
+        return futures
+
+    def has_room(self, n_inflight, n_pages):
+        '''
+        Return True if a batch of n_pages pages can be submitted, while
+        n_inflight pages have been submitted, but not saved yet.
+        '''
+        if not n_inflight or self._max_inflight is None:
+            # Don't let a batch larger than the limit stall processing.
+            return True
+        return n_inflight + n_pages <= self._max_inflight
+
+    def get(self):
+        return self._queue.get()
+
+    def close(self):
+        for i in xrange(self._njobs):
+            # Tell each of the worker threads to finish.
+            self._queue.put(None)
+
+    def stop(self):
+        # Worker threads should not bother with processing other pages.
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.close()
+
+    def reserve(self, size):
+        '''
+        Try to reserve memory for page text of the given size.
+        Return False if that would exceed the memory budget.
+        '''
+        if self._memory_budget is None:
+            return True
+        with self._size_lock:
+            if self._size + size > self._memory_budget:
+                return False
+            self._size += size
+            return True
+
+    def release(self, size):
+        if self._memory_budget is None:
+            return
+        with self._size_lock:
+            self._size -= size
+
+class DocumentJob(object):
+
+    '''
+    Document to be processed, and the directory for its intermediate files.
+    '''
+
+    def __init__(self, path, document, pages, temp_dir):
+        self.path = path
+        self.document = document
+        self.pages = pages
+        self.temp_dir = temp_dir
+        # Results of pages that don't need to be processed again:
+        self.done = {}
+        self.todo = pages
+
+class SpilledResult(object):
+
+    '''
+    Page text that has been moved to disk, so that the memory budget is not
+    exceeded.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+class WorkerError(Exception):
+
+    '''
+    Exception raised in a worker process.
+
+    Only the formatted traceback is passed to the parent process, because not
+    every exception can be pickled.
+    '''
+
+    def __init__(self, traceback, by_user=False):
+        Exception.__init__(self, traceback, by_user)
+        self.traceback = traceback
+        self.by_user = by_user
+
+    def __str__(self):
+        return self.traceback
+
+class Journal(object):
+
+    '''
+    Append-only record of pages that have been processed, which allows
+    resuming an interrupted run.
+
+    Each line is a JSON object with the document's real path, its size and
+    modification time, the page identifier, the fingerprint of options that
+    affect OCR results, and the page text (or null if there was no image
+    suitable for OCR). Every line is synced to disk as soon as it is
+    written, so at most the last line can be lost or truncated in a crash.
+    '''
+
+    def __init__(self, path, fingerprint):
+        self._fingerprint = fingerprint
+        self._entries = {}
+        self._documents = {}
+        size = 0
+        try:
+            file = open(path, 'rb')
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        else:
+            with file:
+                for line in file:
+                    if not line.endswith('\n'):
+                        # The line was truncated in a crash.
+                        break
+                    size += len(line)
+                    self._load_entry(line)
+        self._file = open(path, 'ab')
+        # Get rid of the truncated line (if any),
+        # so that new entries are not appended to it.
+        self._file.truncate(size)
+        self._lock = threading.Lock()
+
+    def _load_entry(self, line):
+        try:
+            entry = json.loads(line)
+            document = entry['document'].encode('ISO-8859-1')
+            [size, mtime] = entry['stamp']
+            page_id = entry['id']
+            fingerprint = entry['fingerprint']
+            text = entry['text']
+        except (ValueError, TypeError, LookupError, AttributeError, UnicodeError):
+            # Malformed entry, or one written by an older version.
+            return
+        if fingerprint != self._fingerprint:
+            return
+        if text is None:
+            text = False
+        else:
+            text = text.encode('ISO-8859-1')
+        self._entries[document, size, mtime, page_id] = text
+
+    def _get_document_key(self, path):
+        '''
+        Return the real path of the document, its size and modification time.
+
+        The key is computed only once for every path, so that it doesn't change
+        when the document is saved in place.
+        '''
+        with self._lock:
+            key = self._documents.get(path)
+            if key is None:
+                st = os.stat(path)
+                key = self._documents[path] = (os.path.realpath(path), st.st_size, st.st_mtime)
+            return key
+
+    def get(self, document, page_id):
+        '''
+        Return the recorded page text, False (if there was no image suitable
+        for OCR), or None (if the page has not been recorded).
+        '''
+        return self._entries.get(self._get_document_key(document) + (page_id,))
+
+    def record(self, document, page_id, text):
+        document, size, mtime = self._get_document_key(document)
+        # Paths and page texts are byte strings that are not necessarily valid
+        # UTF-8. ISO-8859-1 maps every byte to a character, so they round-trip
+        # exactly.
+        entry = dict(
+            document=document.decode('ISO-8859-1'),
+            stamp=[size, mtime],
+            id=page_id,
+            fingerprint=self._fingerprint,
+            text=(text.decode('ISO-8859-1') if text else None),
+        )
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+class NullJournal(object):
+
+    '''
+    Journal that doesn't record anything (used without --resume).
+    '''
+
+    def get(self, document, page_id):
+        return None
+
+    def record(self, document, page_id, text):
+        pass
+
+    def close(self):
+        pass
+
+def get_options_fingerprint(options):
+    '''
+    Return a hash of options that affect OCR results.
+    '''
+    data = [
+        # This includes the engine version, as far as possible:
+        options.engine.get_cache_key(),
+        options.language,
+        str(options.details),
+        options.uax29,
+        options.render_layers,
+        options.html5,
+        sorted(options.properties),
+    ]
+    return hashlib.sha1(json.dumps(data)).hexdigest()
+
+def has_text(page):
+    '''
+    Return True if the page already has non-blank hidden text.
+    Pages whose text cannot be decoded are treated as having no text.
+    '''
+    page.text.wait()
+    try:
+        page_text = page.text.sexpr
+    except (djvu.decode.NotAvailable, djvu.decode.JobFailed):
+        return False
+    if not page_text:
+        return False
+    def walk(zone):
+        for item in zone[5:]:
+            if isinstance(item, tuple):
+                if walk(item):
+                    return True
+            elif isinstance(item, str) and item.strip():
+                return True
+        return False
+    return walk(page_text.value)
+
+def serialize_text(zone):
+    with stats.timer('serialize'):
+        file = io.BytesIO()
+        zone.print_into(file)
+        return file.getvalue()
+
+def serialize_result(result):
+    if result is None or isinstance(result, bool):
+        return result
+    return serialize_text(result)
+
+_worker_context = None
+
+def _init_worker(options, temp_dir):
+    global _worker_context
+    context = Context()
+    context.init(options, temp_dir=temp_dir)
+    _worker_context = context
+
+@contextlib.contextmanager
+def _worker_exceptions():
+    try:
+        yield
+    except djvu.decode.NotAvailable:
+        raise
+    except KeyboardInterrupt:
+        raise WorkerError(traceback.format_exc(), by_user=True)
+    except Exception as ex:
+        interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
+        raise WorkerError(traceback.format_exc(), by_user=interrupted_by_user)
+
+def _process_page_in_worker(path, temp_dir, n):
+    context = _worker_context
+    page = context.get_worker_document(path).pages[n]
+    with _worker_exceptions(), stats.pages(context.stats, path, [n + 1]):
+        return serialize_result(context.process_page(page, temp_dir))
+
+def _process_pages_in_worker(path, temp_dir, ns):
+    context = _worker_context
+    document = context.get_worker_document(path)
+    pages = [document.pages[n] for n in ns]
+    with _worker_exceptions(), stats.pages(context.stats, path, [n + 1 for n in ns]):
+        return map(serialize_result, context.process_pages(pages, temp_dir))
 
 class Context(djvu.decode.Context):
 
-    def init(self, options):
-        self._temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+    _worker_path = None
+    _worker_document = None
+
+    def init(self, options, temp_dir=None):
+        if temp_dir is None:
+            temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        self._temp_dir = temp_dir
         self._debug = options.debug
         self._options = options
+        self._engine = options.engine
+        self._pool = None
+        self._journal = None
+        if options.cache_dir is None:
+            self._cache = None
+        else:
+            self._cache = cache.Cache(options.cache_dir, max_size=options.cache_size)
+        stats_path = options.stats_path
+        if stats_path is None and options.stats_prometheus_path is not None:
+            stats_path = os.path.join(temp_dir, 'ocrodjvu.stats')
+        if stats_path is None:
+            self.stats = None
+        else:
+            self.stats = stats.Stats(stats_path)
         bpp = 24 if self._options.render_layers != djvu.decode.RENDER_MASK_ONLY else 1
         self._image_format = self._options.engine.image_format(bpp)
 
-    def _temp_file(self, name, auto_remove=True):
-        path = os.path.join(self._temp_dir, name)
+    def _temp_file(self, name, temp_dir=None, auto_remove=True):
+        path = os.path.join(temp_dir or self._temp_dir, name)
         file = open(path, 'w+b')
         if not self._debug and auto_remove:
             file = temporary.wrapper(file, file.name)
@@ -411,16 +883,38 @@ class Context(djvu.decode.Context):
         if isinstance(message, djvu.decode.ErrorMessage):
             logger.warning(message)
 
-    @contextlib.contextmanager
-    def get_output_image(self, nth, page_job):
+    def get_worker_document(self, path):
+        if path != self._worker_path:
+            # Pages are dispatched document by document, so keeping only the
+            # most recently used document open is enough.
+            document = self.new_document(djvu.decode.FileURI(path))
+            document.decoding_job.wait()
+            self._worker_path = path
+            self._worker_document = document
+        return self._worker_document
+
+    def render_image(self, nth, page_job, temp_dir=None):
         output_format = self._image_format
-        file = self._temp_file('{n:06}.{ext}'.format(
-            n=nth,
-            ext=output_format.extension
-        ))
+        if self._engine.needs_image_file or self._debug:
+            file = self._temp_file('{n:06}.{ext}'.format(
+                n=nth,
+                ext=output_format.extension
+            ), temp_dir=temp_dir)
+        else:
+            file = io.BytesIO()
+        try:
+            with stats.timer('render'):
+                output_format.write_image(page_job, self._options.render_layers, file)
+                file.flush()
+        except:
+            file.close()
+            raise
+        return file
+
+    @contextlib.contextmanager
+    def get_output_image(self, nth, page_job, temp_dir=None):
+        file = self.render_image(nth, page_job, temp_dir)
         try:
-            output_format.write_image(page_job, self._options.render_layers, file)
-            file.flush()
             yield file
         finally:
             file.close()
@@ -438,21 +932,56 @@ class Context(djvu.decode.Context):
         )
         result.save(prefix)
 
-    def process_page(self, page):
+    def recognize_many(self, images):
+        options = self._options
+        results = [None] * len(images)
+        if self._cache is not None:
+            keys = [
+                cache.get_key(image,
+                    self._engine.get_cache_key(),
+                    self._image_format.extension,
+                    options.language,
+                    str(options.details),
+                    options.uax29,
+                )
+                for image in images
+            ]
+            results = map(self._cache.get, keys)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        with stats.timer('ocr'):
+            new_results = self._engine.recognize_many(
+                [images[i] for i in missing],
+                language=options.language, details=options.details, uax29=options.uax29
+            )
+        for i, result in zip(missing, new_results):
+            results[i] = result
+            if self._cache is not None:
+                self._cache.put(keys[i], result)
+        return results
+
+    def recognize(self, image):
+        [result] = self.recognize_many([image])
+        return result
+
+    def decode_page(self, page):
         logger.info('- Page #{0}'.format(page.n + 1))
-        page_job = page.decode(wait=True)
+        with stats.timer('decode'):
+            page_job = page.decode(wait=True)
         # Because of a bug in python-djvulibre <= 0.3.9,
         # sometimes the exception is not raised.
         # Raise in manually in such case.
         if issubclass(page_job.status, djvu.decode.JobFailed):
             raise page_job.status
-        size = page_job.size
-        with self.get_output_image(page.n, page_job) as pfile:
-            result = self._engine.recognize(pfile, language=self._options.language, details=self._options.details, uax29=self._options.uax29)
-            if self._debug:
-                result.save(os.path.join(self._temp_dir, '{n:06}'.format(n=page.n)))
-            self.save_raw_ocr(page, result)
-            [text] = self._engine.extract_text(result.as_stringio(),
+        return page_job
+
+    def extract_text(self, page, size, result, temp_dir):
+        if self._debug:
+            result.save(os.path.join(temp_dir, '{n:06}'.format(n=page.n)))
+        self.save_raw_ocr(page, result)
+        with stats.timer('extract'):
+            [zone] = self._engine.extract_zones(result.as_stringio(),
                 rotation=page.rotation,
                 details=self._options.details,
                 uax29=self._options.uax29,
@@ -460,139 +989,398 @@ class Context(djvu.decode.Context):
                 fix_utf8=self._engine.needs_utf8_fix,
                 page_size=size
             )
-            # It should be: (page 0 0 <width> <height> …):
-            assert len(text) > 5
-            return text
-
-    def page_thread(self, pages, results, condition):
-        for page in pages:
-            n = page.n
-            with condition:
-                result = results[n]
-                if result is not None:
-                    # The page is being processed or has been already processed.
+        assert zone.type == text_zones.const.TEXT_ZONE_PAGE
+        return zone
+
+    def keep_text(self, page):
+        '''
+        Return True if the existing text of the page should be left alone.
+        '''
+        if not self._options.skip_existing_text:
+            return False
+        # Checking the text layer is much cheaper than decoding the page.
+        if has_text(page):
+            logger.info('Keeping the existing text.')
+            return True
+        return False
+
+    def process_page(self, page, temp_dir=None):
+        '''
+        Process the page. Return its text zone, or True if the existing text
+        of the page should be kept.
+        '''
+        if self.keep_text(page):
+            return True
+        temp_dir = temp_dir or self._temp_dir
+        page_job = self.decode_page(page)
+        with self.get_output_image(page.n, page_job, temp_dir) as pfile:
+            result = self.recognize(pfile)
+            return self.extract_text(page, page_job.size, result, temp_dir)
+
+    def process_pages(self, pages, temp_dir=None):
+        '''
+        Process pages, letting the OCR engine recognize them in a single run.
+        Return list of page text zones, False for pages without image suitable
+        for OCR, True for pages whose existing text should be kept, or None for
+        pages that failed (and should be processed again one by one, so that
+        the error is reported).
+        '''
+        temp_dir = temp_dir or self._temp_dir
+        rendered = []
+        texts = {}
+        try:
+            for page in pages:
+                try:
+                    with stats.subset([page.n + 1]):
+                        if self.keep_text(page):
+                            texts[page.n] = True
+                            continue
+                        page_job = self.decode_page(page)
+                        image = self.render_image(page.n, page_job, temp_dir)
+                except djvu.decode.NotAvailable:
+                    logger.info('No image suitable for OCR.')
                     continue
-                # Mark the page as taken.
-                results[n] = True
-            try:
-                result = self.process_page(page)
-            except djvu.decode.NotAvailable:
-                logger.info('No image suitable for OCR.')
-                result = False
-            except (SystemExit, KeyboardInterrupt) as ex:
-                with condition:
-                    condition.notify()
-                raise
-            except Exception as ex:
+                except Exception:
+                    texts[page.n] = None
+                    continue
+                rendered += [(page, page_job, image)]
+            results = self.recognize_many([item[2] for item in rendered])
+            for (page, page_job, image), result in zip(rendered, results):
                 try:
-                    interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
-                    message = 'Exception while processing page {n}:\n{tb}'.format(
-                        n=(n + 1),
-                        tb=traceback.format_exc()
-                    )
-                    logger.error(message.rstrip())
-                    if self._options.resume_on_error and not interrupted_by_user:
-                        # As requested by user, don't abort on error and pretend that nothing happened.
-                        results[n] = False
-                        results.seen_exception = True
-                        continue
-                    else:
-                        # The main thread will take care of aborting the application.
-                        results[n] = ex
+                    with stats.subset([page.n + 1]):
+                        texts[page.n] = self.extract_text(page, page_job.size, result, temp_dir)
+                except Exception:
+                    texts[page.n] = None
+        finally:
+            for page, page_job, image in rendered:
+                image.close()
+        return [texts.get(page.n, False) for page in pages]
+
+    def process_page_serialized(self, job, page):
+        if self._pool is None:
+            with stats.pages(self.stats, job.path, [page.n + 1]):
+                return serialize_result(self.process_page(page, job.temp_dir))
+        return self._pool.apply(_process_page_in_worker, (job.path, job.temp_dir, page.n))
+
+    def process_pages_serialized(self, job, pages):
+        if self._pool is None:
+            with stats.pages(self.stats, job.path, [page.n + 1 for page in pages]):
+                return map(serialize_result, self.process_pages(pages, job.temp_dir))
+        return self._pool.apply(_process_pages_in_worker, (job.path, job.temp_dir, [page.n for page in pages]))
+
+    def spill_result(self, job, n, result):
+        path = os.path.join(job.temp_dir, '{n:06}.djvused'.format(n=n))
+        with open(path, 'wb') as file:
+            file.write(result)
+        return SpilledResult(path)
+
+    def page_thread(self, scheduler):
+        while True:
+            futures = scheduler.get()
+            if futures is None:
+                return
+            if len(futures) > 1:
+                job = futures[0].job
+                try:
+                    results = self.process_pages_serialized(job, [future.page for future in futures])
+                except (SystemExit, KeyboardInterrupt) as ex:
+                    for future in futures:
+                        future.set_result(ex)
+                    raise
+                except Exception as ex:
+                    interrupted_by_user = isinstance(ex, (ipc.CalledProcessInterrupted, WorkerError)) and ex.by_user
+                    if interrupted_by_user:
+                        for future in futures:
+                            future.set_result(ex)
                         return
-                finally:
-                    with condition:
-                        condition.notify()
-            with condition:
-                assert results[n] is True
-                results[n] = result
-                condition.notify()
-
-    def _process(self, path, pages=None):
-        self._engine = self._options.engine
+                    results = [None] * len(futures)
+                # Process the failed pages one by one,
+                # to find out which of them caused the problem.
+                retry = []
+                for future, result in zip(futures, results):
+                    if result is None:
+                        retry += [future]
+                    else:
+                        self.finish_page(scheduler, future, result)
+                futures = retry
+            for future in futures:
+                if not self.process_future(scheduler, future):
+                    return
+
+    def finish_page(self, scheduler, future, result):
+        job = future.job
+        page = future.page
+        if result is True:
+            # The existing text is kept; there's nothing to record.
+            future.set_result(result)
+            return
+        self._journal.record(job.path, page.file.id, result)
+        if result and not scheduler.reserve(len(result)):
+            result = self.spill_result(job, page.n, result)
+        future.set_result(result)
+
+    def process_future(self, scheduler, future):
+        '''
+        Process a single page.
+        Return False if the thread should stop.
+        '''
+        job = future.job
+        page = future.page
+        n = page.n
+        try:
+            result = self.process_page_serialized(job, page)
+        except djvu.decode.NotAvailable:
+            logger.info('No image suitable for OCR.')
+            result = False
+        except (SystemExit, KeyboardInterrupt) as ex:
+            future.set_result(ex)
+            raise
+        except Exception as ex:
+            interrupted_by_user = isinstance(ex, (ipc.CalledProcessInterrupted, WorkerError)) and ex.by_user
+            if isinstance(ex, WorkerError):
+                tb = ex.traceback
+            else:
+                tb = traceback.format_exc()
+            message = 'Exception while processing page {n}:\n{tb}'.format(
+                n=(n + 1),
+                tb=tb
+            )
+            logger.error(message.rstrip())
+            if self._options.resume_on_error and not interrupted_by_user:
+                # As requested by user, don't abort on error and pretend that nothing happened.
+                scheduler.seen_exception = True
+                future.set_result(False)
+                return True
+            else:
+                # The main thread will take care of aborting the application.
+                future.set_result(ex)
+                return False
+        self.finish_page(scheduler, future, result)
+        return True
+
+    def _open_job(self, path, pages, temp_dir):
         logger.info('Processing {path}:'.format(path=utils.smart_repr(path, system_encoding)))
         document = self.new_document(djvu.decode.FileURI(path))
         document.decoding_job.wait()
+        if issubclass(document.decoding_job.status, djvu.decode.JobFailed):
+            raise document.decoding_job.status
         if pages is None:
             pages = list(document.pages)
         else:
             pages = [document.pages[i - 1] for i in pages]
-        results = Results()
+        job = DocumentJob(path, document, pages, temp_dir)
+        # Pages recorded in the journal don't need to be processed again:
+        for page in pages:
+            result = self._journal.get(path, page.file.id)
+            if result is not None:
+                job.done[page.n] = result
+        if job.done:
+            logger.info('Reusing results for {n} page(s) from the journal.'.format(n=len(job.done)))
+            job.todo = [page for page in pages if page.n not in job.done]
+        return job
+
+    def _process(self, paths, pages=None):
+        journal_path = self._options.journal_path
+        if journal_path is None:
+            self._journal = NullJournal()
+        else:
+            self._journal = Journal(journal_path, get_options_fingerprint(self._options))
         njobs = self._options.n_jobs
-        thread_limit = utils.get_thread_limit(len(pages), njobs)
+        scheduler = Scheduler(
+            njobs,
+            memory_budget=self._options.memory_budget,
+            max_inflight=self._options.max_inflight,
+        )
+        todo_paths = collections.deque(enumerate(paths))
+        # Documents that have been opened, but not saved yet:
+        jobs = collections.deque()
+        # Pages of all the open documents share the worker threads, so that
+        # they don't sit idle near the end of each document. But documents are
+        # opened only as their pages are needed, and only a few of them at a
+        # time.
+        max_open_jobs = njobs + 1
+        batch_size = self._options.batch_size
+        batches = collections.deque()
+        def open_next_job():
+            '''
+            Open the next document, and queue its pages for processing.
+            Return False if there are no more documents.
+            '''
+            while todo_paths:
+                i, path = todo_paths.popleft()
+                if len(paths) > 1:
+                    # Keep intermediate files of each document apart.
+                    temp_dir = os.path.join(self._temp_dir, '{i:04}'.format(i=(i + 1)))
+                    os.mkdir(temp_dir)
+                else:
+                    temp_dir = self._temp_dir
+                try:
+                    job = self._open_job(path, pages, temp_dir)
+                except Exception:
+                    if not self._options.resume_on_error:
+                        raise
+                    message = 'Exception while opening {path}:\n{tb}'.format(
+                        path=utils.smart_repr(path, system_encoding),
+                        tb=traceback.format_exc(),
+                    )
+                    logger.error(message.rstrip())
+                    # As requested by user, skip this document.
+                    scheduler.seen_exception = True
+                    continue
+                jobs.append(job)
+                batches.extend(
+                    (job, job.todo[j:(j + batch_size)])
+                    for j in xrange(0, len(job.todo), batch_size)
+                )
+                return True
+            return False
+        open_next_job()
+        thread_limit = utils.get_thread_limit(len(batches) + len(todo_paths), njobs)
         os.environ['OMP_THREAD_LIMIT'] = str(thread_limit)
-        condition = threading.Condition()
+        if self._options.workers == 'process' and (batches or todo_paths):
+            # Decoding and rendering pages, as well as parsing OCR results,
+            # hold the GIL, so let worker processes do that. Each of them uses
+            # its own DjVuLibre context.
+            self._pool = multiprocessing.Pool(njobs, _init_worker, (self._options, self._temp_dir))
         threads = [
-            threading.Thread(target=self.page_thread, args=(pages, results, condition))
+            threading.Thread(target=self.page_thread, args=(scheduler,))
             for i in xrange(njobs)
         ]
-        def stop_threads():
-            with condition:
-                for page in pages:
-                    # Worker threads should not bother with processing other pages.
-                    # Mark them as already taken.
-                    results[page.n] = True
+        for thread in threads:
+            # In the process mode, the threads merely wait for the worker
+            # processes. Don't let them keep the program running after the pool
+            # has been terminated.
+            thread.daemon = self._pool is not None
         for thread in threads:
             thread.start()
-        sed_file = self._temp_file('ocrodjvu.djvused', auto_remove=False)
+        futures = collections.deque()
+        def submit_batches():
+            while True:
+                if not batches:
+                    if len(jobs) >= max_open_jobs or not open_next_job():
+                        break
+                    continue
+                job, job_pages = batches[0]
+                if not scheduler.has_room(len(futures), len(job_pages)):
+                    # Don't start processing pages that are too far ahead of
+                    # the one we are waiting for.
+                    break
+                batches.popleft()
+                futures.extend(scheduler.submit(job, job_pages))
         try:
-            if self._options.clear_text:
-                sed_file.write('remove-txt\n')
-            for page in pages:
+            submit_batches()
+            while jobs:
+                job = jobs[0]
+                sed_file = self._temp_file('ocrodjvu.djvused', temp_dir=job.temp_dir, auto_remove=False)
+                saver = self._options.saver
+                document = job.document
+                job.document = None
+                if saver.in_place:
+                    document = None
+                pages_to_save = None
+                if self._options.ocr_only:
+                    pages_to_save = [page.n for page in job.pages]
+                stream = None
                 try:
-                    file_id = page.file.id.encode(system_encoding)
-                except UnicodeError:
-                    pageno = page.n + 1
-                    logger.warning('warning: cannot convert page {n} identifier to locale encoding'.format(n=pageno))
-                    sed_file.write('select {n}\n'.format(n=pageno))
-                else:
-                    sed_file.write("select '{fileid}'\n".format(
-                        fileid=file_id.replace('\\', '\\\\').replace("'", "\\'")
-                    ))
-                sed_file.write('set-txt\n')
-                result = None
-                with condition:
-                    while True:
-                        result = results[page.n]
-                        if result is None or result is True:
-                            # Result is not yet available.
-                            condition.wait()
+                    if self._options.stream_save:
+                        # Let djvused apply the script while the remaining
+                        # pages are being processed.
+                        stream = saver.open_stream(document, pages_to_save, job.path)
+                    if stream is None:
+                        output = sed_file
+                    else:
+                        output = TeeFile(sed_file, stream)
+                    if self._options.clear_text:
+                        output.write('remove-txt\n')
+                    for page in job.pages:
+                        result = job.done.get(page.n)
+                        # Results replayed from the journal were never
+                        # reserved, so they must not be released either:
+                        reserved = result is None
+                        if result is None:
+                            future = futures.popleft()
+                            assert future.page is page
+                            result = future.result()
+                            del future  # no longer needed
+                            if isinstance(result, BaseException):
+                                scheduler.stop()
+                            else:
+                                submit_batches()
+                        if isinstance(result, BaseException):
+                            if len(threads) > 1:
+                                logger.info('Waiting for other threads to finish...')
+                            for thread in threads:
+                                thread.join()
+                            self._debug = True
+                            sys.exit(errors.EXIT_FATAL)
+                        if result is True:
+                            # Keep the existing text.
                             continue
-                        results[page.n] = Ellipsis  # no longer needed
-                        if isinstance(result, Exception):
-                            stop_threads()
-                        break
-                if isinstance(result, Exception):
-                    if len(threads) > 1:
-                        logger.info('Waiting for other threads to finish...')
-                    for thread in threads:
-                        thread.join()
-                    self._debug = True
-                    sys.exit(errors.EXIT_FATAL)
-                if result is False:
-                    # No image suitable for OCR.
-                    pass
-                else:
-                    text_zones.print_sexpr(result, sed_file)
-                result = None  # no longer needed
-                sed_file.write('\n.\n\n')
-            sed_file.flush()
-            saver = self._options.saver
-            if saver.in_place:
-                document = None
-            pages_to_save = None
-            if self._options.ocr_only:
-                pages_to_save = [page.n for page in pages]
-            self._options.saver.save(document, pages_to_save, path, sed_file)
-            document = None
+                        try:
+                            file_id = page.file.id.encode(system_encoding)
+                        except UnicodeError:
+                            pageno = page.n + 1
+                            logger.warning('warning: cannot convert page {n} identifier to locale encoding'.format(n=pageno))
+                            output.write('select {n}\n'.format(n=pageno))
+                        else:
+                            output.write("select '{fileid}'\n".format(
+                                fileid=file_id.replace('\\', '\\\\').replace("'", "\\'")
+                            ))
+                        output.write('set-txt\n')
+                        if result is False:
+                            # No image suitable for OCR.
+                            pass
+                        elif isinstance(result, SpilledResult):
+                            output.write(result.read())
+                            if not self._debug:
+                                os.remove(result.path)
+                        else:
+                            if reserved:
+                                scheduler.release(len(result))
+                            output.write(result)
+                        result = None  # no longer needed
+                        output.write('\n.\n\n')
+                        if stream is not None:
+                            stream.flush()
+                    sed_file.flush()
+                    with stats.pages(self.stats, job.path, None), stats.timer('save'):
+                        if stream is None:
+                            saver.save(document, pages_to_save, job.path, sed_file)
+                        else:
+                            stream.close()
+                    document = None
+                except:
+                    if stream is not None:
+                        stream.abort()
+                    raise
+                finally:
+                    sed_file.close()
+                jobs.popleft()
+                # Make room for the next document.
+                submit_batches()
+            scheduler.close()
         except:
-            stop_threads()
+            scheduler.stop()
             raise
         finally:
-            sed_file.close()
-        if results.seen_exception:
+            self._journal.close()
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+        if self.stats is not None:
+            self.write_stats_summary()
+        if scheduler.seen_exception:
             sys.exit(errors.EXIT_NONFATAL)
 
+    def write_stats_summary(self):
+        self.stats.close()
+        summary = stats.summarize(self.stats.path)
+        if self._options.stats_path is not None:
+            with open(self._options.stats_path, 'ab') as file:
+                stats.write_summary(summary, file)
+        if self._options.stats_prometheus_path is not None:
+            stats.write_prometheus(summary, self._options.stats_prometheus_path)
+
     def process(self, *args, **kwargs):
         try:
             self._process(*args, **kwargs)
@@ -613,7 +1401,7 @@ def main(argv=sys.argv):
     context = Context()
     context.init(options)
     try:
-        context.process(options.path, options.pages)
+        context.process(options.paths, options.pages)
     except KeyboardInterrupt:
         logger.info('Interrupted by user.')
         sys.exit(errors.EXIT_FATAL)
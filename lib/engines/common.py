@@ -13,16 +13,22 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+from .. import ipc
 from .. import utils
 from .. import image_io
 
 import io
+import json
+import os
 
 class Engine(object):
 
     name = None
     image_format = None
     needs_utf8_fix = False
+    # If false, the image passed to recognize() may be an in-memory file
+    # without a name:
+    needs_image_file = True
     default_language = 'eng'
 
     def __init__(self, *args, **kwargs):
@@ -43,6 +49,43 @@ class Engine(object):
                 raise
             setattr(self, key, value)
 
+    def recognize_many(self, images, language, details=None, uax29=None):
+        '''
+        Recognize many images. Engines that can do it in a single run should
+        override this method.
+        '''
+        return [
+            self.recognize(image, language, details=details, uax29=uax29)
+            for image in images
+        ]
+
+    def extract_text(self, stream, **kwargs):
+        '''
+        Extract DjVu text of pages from the OCR engine output.
+        '''
+        return [zone.sexpr for zone in self.extract_zones(stream, **kwargs)]
+
+    def get_cache_key(self):
+        '''
+        Return a string identifying the engine, its properties and, as far as
+        possible, its version.
+        '''
+        cls = type(self)
+        data = [self.name]
+        for key in sorted(dir(cls)):
+            if not isinstance(getattr(cls, key), utils.property):
+                continue
+            value = getattr(self, key)
+            data += [key, repr(value)]
+            if key.endswith('executable'):
+                # Engines don't report their versions,
+                # but upgrading an engine replaces its executable.
+                path = ipc.which(value)
+                if path is not None:
+                    st = os.stat(path)
+                    data += [os.path.realpath(path), st.st_size, st.st_mtime]
+        return json.dumps(data)
+
 class Output(object):
 
     format = None
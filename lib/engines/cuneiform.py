@@ -23,6 +23,7 @@ from .. import errors
 from .. import image_io
 from .. import ipc
 from .. import iso639
+from .. import probes
 from .. import temporary
 from .. import utils
 
@@ -54,7 +55,7 @@ class Engine(common.Engine):
         from .. import hocr
         self._hocr = hocr
 
-    def _get_languages(self):
+    def _get_codes(self):
         try:
             cuneiform = ipc.Subprocess([self.executable, '-l'],
                 stdin=ipc.DEVNULL,
@@ -62,44 +63,12 @@ class Engine(common.Engine):
             )
         except OSError:
             raise errors.UnknownLanguageList
-        self._cuneiform_to_iso = {}
-        self._user_to_cuneiform = {}
         try:
             for line in cuneiform.stdout:
                 m = _language_info_pattern.match(line)
                 if m is None:
                     continue
-                codes = m.group(1).split()
-                for code in codes:
-                    if code == 'ruseng':
-                        isocode = 'rus+eng'
-                        # For compatibility with ocrodjvu ≤ 0.7.14:
-                        self._user_to_cuneiform[frozenset(['rus-eng'])] = code
-                    elif code == 'slo':
-                        if 'slv' not in codes:
-                            # Cuneiform ≤ 1.0 mistakenly uses ‘slo’ as language code
-                            # for Slovenian.
-                            # https://bugs.launchpad.net/cuneiform-linux/+bug/707951
-                            isocode = 'slv'
-                        else:
-                            # Both ‘slo’ and ‘slv’ are available. Let's guess that
-                            # the former means Slovak.
-                            isocode = 'slk'
-                    else:
-                        try:
-                            isocode = str.join('+', (
-                                iso639.b_to_t(c) for c in code.split('_')
-                            ))
-                        except ValueError:
-                            warnings.warn(
-                                'unparsable language code: {0!r}'.format(code),
-                                category=RuntimeWarning,
-                                stacklevel=2
-                            )
-                    self._cuneiform_to_iso[code] = isocode
-                    self._user_to_cuneiform[frozenset(isocode.split('+'))] = code
-                    yield isocode
-                return
+                return m.group(1).split()
         finally:
             try:
                 cuneiform.wait()
@@ -109,6 +78,40 @@ class Engine(common.Engine):
                 raise errors.UnknownLanguageList
         raise errors.UnknownLanguageList
 
+    def _get_languages(self):
+        codes = probes.cached(self.executable, 'languages', self._get_codes)
+        self._cuneiform_to_iso = {}
+        self._user_to_cuneiform = {}
+        for code in codes:
+            if code == 'ruseng':
+                isocode = 'rus+eng'
+                # For compatibility with ocrodjvu ≤ 0.7.14:
+                self._user_to_cuneiform[frozenset(['rus-eng'])] = code
+            elif code == 'slo':
+                if 'slv' not in codes:
+                    # Cuneiform ≤ 1.0 mistakenly uses ‘slo’ as language code
+                    # for Slovenian.
+                    # https://bugs.launchpad.net/cuneiform-linux/+bug/707951
+                    isocode = 'slv'
+                else:
+                    # Both ‘slo’ and ‘slv’ are available. Let's guess that
+                    # the former means Slovak.
+                    isocode = 'slk'
+            else:
+                try:
+                    isocode = str.join('+', (
+                        iso639.b_to_t(c) for c in code.split('_')
+                    ))
+                except ValueError:
+                    warnings.warn(
+                        'unparsable language code: {0!r}'.format(code),
+                        category=RuntimeWarning,
+                        stacklevel=2
+                    )
+            self._cuneiform_to_iso[code] = isocode
+            self._user_to_cuneiform[frozenset(isocode.split('+'))] = code
+            yield isocode
+
     def check_language(self, language):
         if language == 'slo':
             # Normally we accept Cuneiform-specific language code. This is an
@@ -163,7 +166,7 @@ class Engine(common.Engine):
                     format='html',
                 )
 
-    def extract_text(self, *args, **kwargs):
-        return self._hocr.extract_text(*args, **kwargs)
+    def extract_zones(self, *args, **kwargs):
+        return self._hocr.extract_zones(*args, **kwargs)
 
 # vim:ts=4 sts=4 sw=4 et
@@ -31,9 +31,9 @@ class Engine(common.Engine):
     def recognize(self, image, language, details=None, uax29=None):
         return common.Output('', format='dummy')
 
-    def extract_text(self, stream, **kwargs):
+    def extract_zones(self, stream, **kwargs):
         bbox = text_zones.BBox(0, 0, 0, 0)
         page = text_zones.Zone(text_zones.const.TEXT_ZONE_PAGE, bbox, [])
-        return [page.sexpr]
+        return [page]
 
 # vim:ts=4 sts=4 sw=4 et
@@ -21,6 +21,7 @@ from . import common
 from .. import errors
 from .. import image_io
 from .. import ipc
+from .. import probes
 from .. import text_zones
 from .. import unicode_support
 from .. import utils
@@ -35,11 +36,7 @@ class ExtractSettings(object):
         self.rotation = rotation
         self.details = details
         if uax29 is not None:
-            icu = unicode_support.get_icu()
-            if uax29 is True:
-                uax29 = icu.Locale('en-US-POSIX')
-            else:
-                uax29 = icu.Locale(uax29)
+            uax29 = unicode_support.get_locale(uax29)
         self.uax29 = uax29
         self.page_size = page_size
 
@@ -110,7 +107,7 @@ class Engine(common.Engine):
     def __init__(self, *args, **kwargs):
         common.Engine.__init__(self, **kwargs)
         try:
-            self._languages = self._get_languages()
+            self._languages = probes.cached(self.executable, 'languages', self._get_languages)
         except errors.UnknownLanguageList:
             raise errors.EngineNotFound(self.name)
 
@@ -164,10 +161,10 @@ class Engine(common.Engine):
         finally:
             worker.wait()
 
-    def extract_text(self, stream, **kwargs):
+    def extract_zones(self, stream, **kwargs):
         settings = ExtractSettings(**kwargs)
         settings.replacement_character = self.replacement_character
         scan_result = scan(stream, settings)
-        return [scan_result.sexpr]
+        return [scan_result]
 
 # vim:ts=4 sts=4 sw=4 et
@@ -20,6 +20,7 @@ from . import tesseract
 from .. import errors
 from .. import image_io
 from .. import ipc
+from .. import probes
 from .. import utils
 
 class Engine(common.Engine):
@@ -35,7 +36,6 @@ class Engine(common.Engine):
 
     def __init__(self, *args, **kwargs):
         common.Engine.__init__(self, **kwargs)
-        self.tesseract = tesseract.Engine(executable=self.tesseract_executable)
         # Determine:
         # - if OCRopus is installed and
         # - which version we are dealing with
@@ -43,22 +43,15 @@ class Engine(common.Engine):
             script_names = ['recognize', 'rec-tess']
         else:
             script_names = [self._script_name]
-        for script_name in script_names:
-            try:
-                ocropus = ipc.Subprocess(['ocroscript', script_name],
-                    stdin=ipc.DEVNULL,
-                    stdout=ipc.PIPE,
-                    stderr=ipc.DEVNULL,
-                )
-            except OSError:
-                raise errors.EngineNotFound(self.name)
-            try:
-                found = ocropus.stdout.read(7) == 'Usage: '
-            finally:
-                try:
-                    ocropus.wait()
-                except ipc.CalledProcessError:
-                    pass
+        results = probes.run_parallel(
+            [lambda: tesseract.Engine(executable=self.tesseract_executable)] +
+            [
+                lambda script_name=script_name: probes.cached('ocroscript', 'script', self._has_script, script_name)
+                for script_name in script_names
+            ]
+        )
+        self.tesseract = results[0]
+        for script_name, found in zip(script_names, results[1:]):
             if found:
                 self.script_name = script_name
                 break
@@ -72,6 +65,23 @@ class Engine(common.Engine):
         from .. import hocr
         self._hocr = hocr
 
+    def _has_script(self, script_name):
+        try:
+            ocropus = ipc.Subprocess(['ocroscript', script_name],
+                stdin=ipc.DEVNULL,
+                stdout=ipc.PIPE,
+                stderr=ipc.DEVNULL,
+            )
+        except OSError:
+            raise errors.EngineNotFound(self.name)
+        try:
+            return ocropus.stdout.read(7) == 'Usage: '
+        finally:
+            try:
+                ocropus.wait()
+            except ipc.CalledProcessError:
+                pass
+
     def check_language(self, language):
         return self.tesseract.check_language(language)
 
@@ -104,7 +114,7 @@ class Engine(common.Engine):
         finally:
             ocropus.wait()
 
-    def extract_text(self, *args, **kwargs):
-        return self._hocr.extract_text(*args, **kwargs)
+    def extract_zones(self, *args, **kwargs):
+        return self._hocr.extract_zones(*args, **kwargs)
 
 # vim:ts=4 sts=4 sw=4 et
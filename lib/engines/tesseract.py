@@ -16,11 +16,13 @@
 from __future__ import print_function
 
 import cgi
+import errno
 import glob
 import os
 import re
 import shlex
 import sys
+import threading
 import warnings
 
 from . import common
@@ -28,6 +30,7 @@ from .. import errors
 from .. import image_io
 from .. import ipc
 from .. import iso639
+from .. import probes
 from .. import temporary
 from .. import text_zones
 from .. import utils
@@ -39,6 +42,9 @@ _error_pattern = re.compile(
     r"^(Error openn?ing data|Unable to load unicharset) file (?P<dir>/.*)/nonexistent[.](?P<ext>[a-z]+)$",
     re.MULTILINE
 )
+_version_pattern = re.compile(r'^tesseract v?([0-9]+)[.]([0-9]+)', re.MULTILINE)
+_hocr_page_pattern = re.compile(r'''<div\s+class=['"]ocr_page['"]''')
+_tsv_header = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext'
 
 _bbox_extras_template = '''\
 <!-- The following script was appended to hOCR by ocrodjvu for internal purposes. -->
@@ -59,8 +65,10 @@ def _filter_boring_stderr(stderr):
         # because we always pass just a single page to Tesseract.
         del stderr[0]
 
-def _wait_for_worker(worker):
-    stderr = worker.stderr.read().splitlines()
+def _wait_for_worker(worker, stderr=None):
+    if stderr is None:
+        stderr = worker.stderr.read()
+    stderr = stderr.splitlines()
     def print_errors():
         for line in stderr:
             print('tesseract: {0}'.format(line), file=sys.stderr)
@@ -72,6 +80,166 @@ def _wait_for_worker(worker):
     _filter_boring_stderr(stderr)
     print_errors()
 
+def _communicate(worker, input):
+    '''
+    Feed input to the worker, and return its standard output and standard
+    error.
+
+    Unlike Popen.communicate(), don't wait for the worker to terminate.
+    '''
+    def write_input():
+        try:
+            worker.stdin.write(input)
+        except IOError as ex:
+            # The worker might have exited without reading the whole input.
+            if ex.errno != errno.EPIPE:
+                raise
+        finally:
+            try:
+                worker.stdin.close()
+            except IOError:
+                pass
+    stderr = []
+    def read_stderr():
+        stderr.append(worker.stderr.read())
+    threads = [
+        threading.Thread(target=write_input),
+        threading.Thread(target=read_stderr),
+    ]
+    for thread in threads:
+        thread.start()
+    stdout = worker.stdout.read()
+    for thread in threads:
+        thread.join()
+    [stderr] = stderr
+    return stdout, stderr
+
+def split_hocr(contents):
+    '''
+    Split multi-page hOCR into single-page hOCR documents.
+    '''
+    starts = [match.start() for match in _hocr_page_pattern.finditer(contents)]
+    end = contents.rfind('</body>')
+    if not starts or end < starts[-1]:
+        raise errors.MalformedHocr('cannot find pages')
+    head = contents[:starts[0]]
+    tail = contents[end:]
+    bounds = starts + [end]
+    return [
+        head + contents[i:j] + tail
+        for i, j in zip(bounds, bounds[1:])
+    ]
+
+def split_tsv(contents):
+    '''
+    Split multi-page TSV output into single-page TSV documents.
+    '''
+    pages = []
+    for line in contents.splitlines(True):
+        fields = line.split('\t', 2)
+        if len(fields) < 3 or fields[0] == 'level':
+            continue
+        if fields[0] == '1':
+            pages += [[_tsv_header + '\n']]
+        elif not pages:
+            raise errors.MalformedOcrOutput('cannot find pages')
+        pages[-1] += [line]
+    return [str.join('', page) for page in pages]
+
+_tsv_zone_types = {
+    '1': const.TEXT_ZONE_PAGE,
+    '2': const.TEXT_ZONE_COLUMN,
+    '3': const.TEXT_ZONE_PARAGRAPH,
+    '4': const.TEXT_ZONE_LINE,
+    '5': const.TEXT_ZONE_WORD,
+}
+
+def _make_tsv_zone(zone_type, bbox, children, details):
+    '''
+    Return text zone (or plain text, if the zone is too fine-grained for the
+    requested details) made out of the children, or None if there's no text.
+    '''
+    if zone_type == const.TEXT_ZONE_PAGE:
+        pass
+    elif not children:
+        return
+    separator = ' ' if zone_type <= const.TEXT_ZONE_LINE else '\n'
+    if zone_type < details:
+        return str.join(separator, children)
+    if children and isinstance(children[0], basestring):
+        children = [str.join(separator, children)]
+    elif zone_type != const.TEXT_ZONE_PAGE:
+        # Bounding box of the whole page is not affected by its children.
+        bbox = text_zones.BBox(*bbox)
+        for child in children:
+            bbox.update(child.bbox)
+    return text_zones.Zone(zone_type, bbox, children)
+
+def scan_tsv(stream, settings):
+    '''
+    Return an iterator over page text zones of Tesseract TSV output.
+    '''
+    contents = stream.read()
+    if settings.fix_utf8:
+        contents = utils.sanitize_utf8(contents)
+    details = settings.details
+    stack = []
+    def pop():
+        zone = _make_tsv_zone(*stack.pop() + [details])
+        if zone is None:
+            return
+        if stack:
+            stack[-1][2].append(zone)
+        else:
+            zone.rotate(settings.rotation)
+            return zone
+    for line in contents.splitlines():
+        fields = line.split('\t', 11)
+        if fields[0] == 'level' or not line:
+            continue
+        if len(fields) == 11:
+            # Tesseract 3.05 omits text of non-word rows.
+            fields += ['']
+        try:
+            zone_type = _tsv_zone_types[fields[0]]
+            x, y, w, h = map(int, fields[6:10])
+        except (LookupError, ValueError):
+            raise errors.MalformedOcrOutput('invalid TSV row: {0!r}'.format(line))
+        while stack and stack[-1][0] <= zone_type:
+            zone = pop()
+            if zone is not None:
+                yield zone
+        if zone_type == const.TEXT_ZONE_PAGE:
+            stack += [[zone_type, (x, y, x + w, y + h), []]]
+            continue
+        if not stack:
+            if settings.page_size is None:
+                raise errors.MalformedOcrOutput('cannot find page size')
+            stack += [[const.TEXT_ZONE_PAGE, (0, 0) + tuple(settings.page_size), []]]
+        bbox = (x, y, x + w, y + h)
+        if zone_type == const.TEXT_ZONE_WORD:
+            text = fields[11]
+            if not text or text.isspace():
+                # Tesseract sometimes returns “empty” words. Let's ignore
+                # those.
+                continue
+            if details <= zone_type:
+                stack[-1][2].append(text_zones.Zone(zone_type, bbox, [text]))
+            else:
+                stack[-1][2].append(text)
+            continue
+        stack += [[zone_type, bbox, []]]
+    while stack:
+        zone = pop()
+        if zone is not None:
+            yield zone
+
+def _needs_character_details(details, uax29):
+    return (
+        details < text_zones.TEXT_DETAILS_WORD or
+        (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
+    )
+
 def fix_html(s):
     '''
     Work around buggy hOCR output:
@@ -97,8 +265,10 @@ def fix_html(s):
 
 class ExtractSettings(object):
 
-    def __init__(self, rotation=0, page_size=None, **kwargs):
+    def __init__(self, rotation=0, details=text_zones.TEXT_DETAILS_WORD, fix_utf8=False, page_size=None, **kwargs):
         self.rotation = rotation
+        self.details = details
+        self.fix_utf8 = fix_utf8
         self.page_size = page_size
 
 class Engine(common.Engine):
@@ -110,14 +280,21 @@ class Engine(common.Engine):
     executable = utils.property('tesseract')
     extra_args = utils.property([], shlex.split)
     use_hocr = utils.property(None, int)
+    use_pipe = utils.property(None, int)
     fix_html = utils.property(0, int)
+    use_tsv = utils.property(0, int)
 
     def __init__(self, *args, **kwargs):
         common.Engine.__init__(self, **kwargs)
         try:
-            self._directory, self._extension = self.get_filesystem_info()
+            (self._directory, self._extension), version = probes.run_parallel([
+                lambda: probes.cached(self.executable, ['filesystem-info', os.environ.get('TESSDATA_PREFIX')], self.get_filesystem_info),
+                lambda: probes.cached(self.executable, 'version', self.get_version),
+            ])
         except errors.UnknownLanguageList:
             raise errors.EngineNotFound(self.name)
+        if version is not None:
+            version = tuple(version)
         if self.use_hocr is None:
             self.use_hocr = self._extension == 'traineddata'
         if self.use_hocr:
@@ -127,6 +304,17 @@ class Engine(common.Engine):
             self._hocr = hocr
         else:
             self._hocr = None
+        if self.use_pipe is None:
+            # Tesseract >= 4.0 can read images from stdin and write results to
+            # stdout, so that no temporary files are needed.
+            self.use_pipe = version is not None and version >= (4, 0)
+        # Tesseract >= 3.04 can recognize images listed in a text file,
+        # loading the language data only once.
+        self._can_read_lists = version is not None and version >= (3, 4)
+        # Tesseract >= 3.05 can produce TSV output, which is much cheaper to
+        # parse than hOCR.
+        self.use_tsv = self.use_tsv and self._hocr is not None and version is not None and version >= (3, 5)
+        self.needs_image_file = not self.use_pipe
         self._user_to_tesseract = None  # to be defined later
         self._languages = list(self._get_languages())
 
@@ -161,6 +349,29 @@ class Engine(common.Engine):
                 warnings.warn('unexpected exit code from Tesseract', category=RuntimeWarning, stacklevel=2)
         return directory, extension
 
+    def get_version(self):
+        try:
+            tesseract = ipc.Subprocess([self.executable, '--version'],
+                stdin=ipc.DEVNULL,
+                stdout=ipc.PIPE,
+                stderr=ipc.STDOUT,
+            )
+        except OSError:
+            return
+        try:
+            # Tesseract < 4.0 prints its version on stderr.
+            output = tesseract.stdout.read()
+        finally:
+            try:
+                tesseract.wait()
+            except ipc.CalledProcessError:
+                # Very old versions don't understand --version.
+                return
+        match = _version_pattern.search(output)
+        if match is None:
+            return
+        return tuple(map(int, match.groups()))
+
     def list_languages(self):
         return iter(self._languages)
 
@@ -202,11 +413,39 @@ class Engine(common.Engine):
     def check_language(self, language):
         self.user_to_tesseract(language)
 
+    def _get_image_path(self, image, output_dir, name='tmp'):
+        try:
+            return image.name
+        except AttributeError:
+            # The image was rendered into memory, because of use_pipe.
+            path = os.path.join(output_dir, name + '.' + self.image_format.extension)
+            with open(path, 'wb') as file:
+                file.write(image.getvalue())
+            return path
+
+    def _recognize_pipe(self, image, language, args):
+        worker = ipc.Subprocess(
+            [self.executable, 'stdin', 'stdout', '-l', language] + self.extra_args + args,
+            stdin=ipc.PIPE,
+            stdout=ipc.PIPE,
+            stderr=ipc.PIPE,
+        )
+        image.seek(0)
+        stdout, stderr = _communicate(worker, image.read())
+        _wait_for_worker(worker, stderr)
+        return stdout
+
     def recognize_plain_text(self, image, language, details=None, uax29=None):
         language = self.user_to_tesseract(language)
+        if self.use_pipe:
+            return common.Output(
+                self._recognize_pipe(image, language, []),
+                format='txt',
+            )
         with temporary.directory() as output_dir:
+            image_path = self._get_image_path(image, output_dir)
             worker = ipc.Subprocess(
-                [self.executable, image.name, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args,
+                [self.executable, image_path, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args,
                 stdin=ipc.DEVNULL,
                 stdout=ipc.DEVNULL,
                 stderr=ipc.PIPE,
@@ -218,20 +457,32 @@ class Engine(common.Engine):
                     format='txt',
                 )
 
+    def _write_tessconf(self, output_dir, variable='tessedit_create_hocr'):
+        tessconf_path = os.path.join(output_dir, 'tessconf')
+        with open(tessconf_path, 'wt') as tessconf:
+            # Tesseract 3.00 doesn't come with any config file to enable hOCR
+            # output. Let's create our own one.
+            print('{0} T'.format(variable), file=tessconf)
+        return tessconf_path
+
     def recognize_hocr(self, image, language, details=text_zones.TEXT_DETAILS_WORD, uax29=None):
         language = self.user_to_tesseract(language)
-        character_details = (
-            details < text_zones.TEXT_DETAILS_WORD or
-            (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
-        )
+        character_details = _needs_character_details(details, uax29)
+        if self.use_pipe and not character_details:
+            contents = self._recognize_pipe(image, language, ['-c', 'tessedit_create_hocr=1'])
+            if self.fix_html:
+                contents = fix_html(contents)
+            return common.Output(
+                contents,
+                format='html',
+            )
+        # Character details require a box file alongside hOCR,
+        # so they cannot be both written to stdout.
         with temporary.directory() as output_dir:
-            tessconf_path = os.path.join(output_dir, 'tessconf')
-            with open(tessconf_path, 'wt') as tessconf:
-                # Tesseract 3.00 doesn't come with any config file to enable hOCR
-                # output. Let's create our own one.
-                print('tessedit_create_hocr T', file=tessconf)
+            image_path = self._get_image_path(image, output_dir)
+            tessconf_path = self._write_tessconf(output_dir)
             commandline = (
-                [self.executable, image.name, os.path.join(output_dir, 'tmp')] +
+                [self.executable, image_path, os.path.join(output_dir, 'tmp')] +
                 ['-l', language] +
                 self.extra_args +
                 [tessconf_path]
@@ -276,21 +527,127 @@ class Engine(common.Engine):
             format='html',
         )
 
+    def recognize_hocr_many(self, images, language):
+        language = self.user_to_tesseract(language)
+        with temporary.directory() as output_dir:
+            list_path = os.path.join(output_dir, 'tmp.lst')
+            with open(list_path, 'wt') as list_file:
+                for i, image in enumerate(images):
+                    image_path = self._get_image_path(image, output_dir, 'tmp{i}'.format(i=i))
+                    print(image_path, file=list_file)
+            tessconf_path = self._write_tessconf(output_dir)
+            worker = ipc.Subprocess(
+                [self.executable, list_path, os.path.join(output_dir, 'tmp')] +
+                ['-l', language] +
+                self.extra_args +
+                [tessconf_path],
+                stdin=ipc.DEVNULL,
+                stdout=ipc.DEVNULL,
+                stderr=ipc.PIPE,
+            )
+            _wait_for_worker(worker)
+            with open(os.path.join(output_dir, 'tmp.hocr'), 'r') as hocr_file:
+                contents = hocr_file.read()
+        pages = split_hocr(contents)
+        if len(pages) != len(images):
+            raise errors.MalformedHocr('expected {n} pages, got {m}'.format(n=len(images), m=len(pages)))
+        if self.fix_html:
+            pages = map(fix_html, pages)
+        return [
+            common.Output(page, format='html')
+            for page in pages
+        ]
+
+    def recognize_tsv(self, image, language, details=None, uax29=None):
+        language = self.user_to_tesseract(language)
+        if self.use_pipe:
+            return common.Output(
+                self._recognize_pipe(image, language, ['-c', 'tessedit_create_tsv=1']),
+                format='tsv',
+            )
+        with temporary.directory() as output_dir:
+            image_path = self._get_image_path(image, output_dir)
+            tessconf_path = self._write_tessconf(output_dir, 'tessedit_create_tsv')
+            worker = ipc.Subprocess(
+                [self.executable, image_path, os.path.join(output_dir, 'tmp')] +
+                ['-l', language] +
+                self.extra_args +
+                [tessconf_path],
+                stdin=ipc.DEVNULL,
+                stdout=ipc.DEVNULL,
+                stderr=ipc.PIPE,
+            )
+            _wait_for_worker(worker)
+            with open(os.path.join(output_dir, 'tmp.tsv'), 'r') as tsv_file:
+                return common.Output(
+                    tsv_file.read(),
+                    format='tsv',
+                )
+
+    def recognize_tsv_many(self, images, language):
+        language = self.user_to_tesseract(language)
+        with temporary.directory() as output_dir:
+            list_path = os.path.join(output_dir, 'tmp.lst')
+            with open(list_path, 'wt') as list_file:
+                for i, image in enumerate(images):
+                    image_path = self._get_image_path(image, output_dir, 'tmp{i}'.format(i=i))
+                    print(image_path, file=list_file)
+            tessconf_path = self._write_tessconf(output_dir, 'tessedit_create_tsv')
+            worker = ipc.Subprocess(
+                [self.executable, list_path, os.path.join(output_dir, 'tmp')] +
+                ['-l', language] +
+                self.extra_args +
+                [tessconf_path],
+                stdin=ipc.DEVNULL,
+                stdout=ipc.DEVNULL,
+                stderr=ipc.PIPE,
+            )
+            _wait_for_worker(worker)
+            with open(os.path.join(output_dir, 'tmp.tsv'), 'r') as tsv_file:
+                contents = tsv_file.read()
+        pages = split_tsv(contents)
+        if len(pages) != len(images):
+            raise errors.MalformedOcrOutput('expected {n} pages, got {m}'.format(n=len(images), m=len(pages)))
+        return [
+            common.Output(page, format='tsv')
+            for page in pages
+        ]
+
     def recognize(self, image, language, details=None, uax29=None):
         if self._hocr is None:
             f = self.recognize_plain_text
+        elif self.use_tsv and not _needs_character_details(details, uax29):
+            f = self.recognize_tsv
         else:
+            # Character details come from a box file,
+            # which is attached to hOCR.
             f = self.recognize_hocr
         return f(image, language, details=details, uax29=uax29)
 
-    def extract_text(self, stream, **kwargs):
+    def recognize_many(self, images, language, details=None, uax29=None):
+        if (
+            self._hocr is None or
+            not self._can_read_lists or
+            len(images) < 2 or
+            _needs_character_details(details, uax29)
+        ):
+            return common.Engine.recognize_many(self, images, language, details=details, uax29=uax29)
+        if self.use_tsv:
+            return self.recognize_tsv_many(images, language)
+        return self.recognize_hocr_many(images, language)
+
+    def extract_zones(self, stream, **kwargs):
         if self._hocr is not None:
-            return self._hocr.extract_text(stream, **kwargs)
+            if stream.readline().startswith('level\t'):
+                stream.seek(0)
+                return list(scan_tsv(stream, ExtractSettings(**kwargs)))
+            stream.seek(0)
+            return self._hocr.extract_zones(stream, **kwargs)
         settings = ExtractSettings(**kwargs)
         bbox = text_zones.BBox(*((0, 0) + settings.page_size))
         text = stream.read()
         zone = text_zones.Zone(const.TEXT_ZONE_PAGE, bbox, [text])
         zone.rotate(settings.rotation)
-        return [zone.sexpr]
+        return [zone]
 
 # vim:ts=4 sts=4 sw=4 et
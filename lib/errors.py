@@ -50,6 +50,11 @@ class EngineNotFound(Exception):
             .format(engine=name)
         )
 
+def _rebuild_exception(cls, args):
+    ex = cls.__new__(cls)
+    Exception.__init__(ex, *args)
+    return ex
+
 class MalformedOcrOutput(Exception):
 
     def __init__(self, message):
@@ -58,6 +63,11 @@ class MalformedOcrOutput(Exception):
             .format(msg=message)
         )
 
+    def __reduce__(self):
+        # The message is already formatted. Don't format it again when
+        # unpickling, e.g. in the parent of a worker process.
+        return _rebuild_exception, (type(self), self.args)
+
 class MalformedHocr(MalformedOcrOutput):
 
     def __init__(self, message):
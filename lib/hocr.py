@@ -21,6 +21,7 @@ http://kba.github.io/hocr-spec/1.2/
 '''
 
 import functools
+import io
 import re
 
 from . import utils
@@ -33,6 +34,7 @@ except ImportError as ex:
 
 from . import errors
 from . import html5_support
+from . import stats
 from . import text_zones
 from . import unicode_support
 
@@ -126,8 +128,13 @@ def _apply_bboxes(djvu_class, bbox_source, text, settings, page_size):
         m = bboxes_re.search(bbox_source)
         if not m:
             return [text]
-        coordinates = (int(x) for x in m.group(1).replace(',', ' ').split())
-        coordinates = zip(coordinates, coordinates, coordinates, coordinates)
+        coordinates = m.group(1).replace(',', ' ')
+        if text_zones.numpy is None:
+            coordinates = (int(x) for x in coordinates.split())
+            coordinates = zip(coordinates, coordinates, coordinates, coordinates)
+        else:
+            coordinates = text_zones.numpy.fromstring(coordinates, dtype=int, sep=' ')
+            coordinates = coordinates.reshape(-1, 4).tolist()
     else:
         # bboxes from an iterator
         coordinates = []
@@ -156,29 +163,23 @@ def _apply_bboxes(djvu_class, bbox_source, text, settings, page_size):
     if djvu_class > const.TEXT_ZONE_WORD:
         # Split words
         words = []
-        break_iterator = unicode_support.word_break_iterator(text, locale=settings.uax29)
-        i = 0
-        for j in break_iterator:
-            subtext = text[i:j]
-            if subtext.isspace():
-                i = j
-                continue
-            bbox = text_zones.BBox()
-            for k in xrange(i, j):
-                if settings.cuneiform and coordinates[k] == (-1, -1, -1, -1):
-                    raise errors.MalformedHocr("missing bbox for non-whitespace character")
-                bbox.update(text_zones.BBox(*coordinates[k]))
+        break_iterator = functools.partial(unicode_support.word_break_iterator, locale=settings.uax29)
+        spans = text_zones.get_word_spans(text, break_iterator)
+        if settings.cuneiform:
+            for i, j in spans:
+                for k in xrange(i, j):
+                    if tuple(coordinates[k]) == (-1, -1, -1, -1):
+                        raise errors.MalformedHocr("missing bbox for non-whitespace character")
+        for (i, j), bbox in zip(spans, text_zones.get_bboxes(coordinates, spans)):
             last_word = text_zones.Zone(type=const.TEXT_ZONE_WORD, bbox=bbox)
             words += [last_word]
             if settings.details > TEXT_DETAILS_CHARACTER:
-                last_word += [subtext]
+                last_word += [text[i:j]]
             else:
                 last_word += [
-                    text_zones.Zone(type=const.TEXT_ZONE_CHARACTER, bbox=(x0, y0, x1, y1), children=[ch])
+                    text_zones.Zone(type=const.TEXT_ZONE_CHARACTER, bbox=coordinates[k], children=[text[k]])
                     for k in xrange(i, j)
-                    for (x0, y0, x1, y1), ch in [(coordinates[k], text[k])]
                 ]
-            i = j
         return words
     else:
         # Split characters
@@ -188,22 +189,13 @@ def _apply_bboxes(djvu_class, bbox_source, text, settings, page_size):
         ]
     return [text]
 
-def _scan(node, settings, page_size=None):
-
-    def get_children(node):
-        result = []
-        if node.text:
-            result += [node.text]
-        for child in node.iterchildren():
-            result += _scan(child, settings, page_size)
-            if child.tail:
-                result += [child.tail]
-        return result
-
-    if not isinstance(node.tag, basestring) or node.tag == 'script':
-        # Ignore non-elements.
-        return []
+def _classify(node, settings, page_size):
+    '''
+    Examine the element before its children are scanned.
 
+    Return (title, bbox, djvu_class, page_size), where page_size applies to
+    the children of the element.
+    '''
     title = node.get('title') or ''
     m = bbox_re.search(title)
     if m is None:
@@ -235,8 +227,7 @@ def _scan(node, settings, page_size=None):
                 djvu_class = cuneiform_tag_to_djvu(node.tag)
 
     if not djvu_class:
-        # Just process our children.
-        return get_children(node)
+        return title, bbox, djvu_class, page_size
 
     if djvu_class is const.TEXT_ZONE_PAGE:
         if not bbox:
@@ -251,10 +242,28 @@ def _scan(node, settings, page_size=None):
     elif page_size is None:
         # At this point page size should be already known.
         raise errors.MalformedHocr('unable to determine page size')
+    return title, bbox, djvu_class, page_size
+
+def _get_children(node, scan_child):
+    result = []
+    if node.text:
+        result += [node.text]
+    for child in node.iterchildren():
+        result += scan_child(child)
+        if child.tail:
+            result += [child.tail]
+    return result
+
+def _make_zones(node, children, title, bbox, djvu_class, settings, page_size):
+    '''
+    Build text zones for the element, once its children are scanned.
+    '''
+    if not djvu_class:
+        # Just pass our children.
+        return children
 
     has_string = has_nonempty_string = False
     has_zone = has_char_zone = has_nonchar_zone = False
-    children = get_children(node)
     if djvu_class is const.TEXT_ZONE_PAGE:
         empty = [text_zones.Zone(type=djvu_class, bbox=bbox)]
     else:
@@ -368,9 +377,18 @@ def _scan(node, settings, page_size=None):
 
     return [text_zones.Zone(type=djvu_class, bbox=bbox, children=children)]
 
-def scan(node, settings):
-    result = []
-    for zone in _scan(node, settings, settings.page_size):
+def _scan(node, settings, page_size=None):
+
+    if not isinstance(node.tag, basestring) or node.tag == 'script':
+        # Ignore non-elements.
+        return []
+
+    title, bbox, djvu_class, page_size = _classify(node, settings, page_size)
+    children = _get_children(node, lambda child: _scan(child, settings, page_size))
+    return _make_zones(node, children, title, bbox, djvu_class, settings, page_size)
+
+def _check_top_level(items, settings):
+    for zone in items:
         if isinstance(zone, basestring):
             if zone == '' or zone.isspace():
                 continue
@@ -378,9 +396,83 @@ def scan(node, settings):
                 raise errors.MalformedHocr("plain text intermixed with structural elements")
         if not isinstance(zone, text_zones.Zone):
             raise TypeError('Unexpected {tp} object; expected a text zone'.format(tp=type(zone).__name__))
-        result += [zone]
         zone.rotate(settings.rotation)
-    return result
+        yield zone
+
+def _pop_preceding_text(body, node):
+    '''
+    Remove children of the body that precede the node. Return text that
+    preceded the node, and which was not returned before.
+    '''
+    items = []
+    if body.text:
+        items += [body.text]
+        body.text = None
+    for child in list(body.iterchildren()):
+        if child is node:
+            break
+        if child.tail:
+            items += [child.tail]
+        body.remove(child)
+    return items
+
+def iterscan(events, settings):
+    '''
+    Scan hOCR document while it is being parsed with etree.iterparse().
+    Yield top-level text zones as soon as their elements are closed.
+
+    Subtrees are freed as soon as they are no longer needed.
+    '''
+    body = None
+    # For each open element of the body: what _classify() returned for it (or
+    # None if the element is ignored), and scan results of its children.
+    stack = []
+    for event, node in events:
+        if body is None:
+            if event == 'start':
+                root = _get_body_root(node)
+                if root is not None:
+                    body = node
+                    detect_ocr_system(root, settings)
+                    stack += [(_classify(body, settings, settings.page_size), [])]
+            continue
+        if not stack:
+            # The body was already scanned.
+            continue
+        if event == 'start':
+            parent_info = stack[-1][0]
+            if parent_info is None or node.tag == 'script':
+                info = None
+            else:
+                info = _classify(node, settings, parent_info[3])
+            stack += [(info, [])]
+            continue
+        info, results = stack.pop()
+        if info is None:
+            result = []
+        else:
+            # Top-level results of a body that is not a zone itself are not
+            # kept, see below.
+            results = iter(results)
+            children = _get_children(node, lambda child: next(results, []) if isinstance(child.tag, basestring) else [])
+            title, bbox, djvu_class, page_size = info
+            result = _make_zones(node, children, title, bbox, djvu_class, settings, page_size)
+        # Parent of this element might still look at its children, but not any
+        # deeper.
+        for child in node:
+            del child[:]
+        if not stack:
+            assert node is body
+            for zone in _check_top_level(result, settings):
+                yield zone
+        elif len(stack) == 1 and not stack[0][0][2]:
+            # This is a child of the body, and the body is not a zone itself,
+            # so the results can be yielded right away.
+            items = _pop_preceding_text(body, node) + result
+            for zone in _check_top_level(items, settings):
+                yield zone
+        else:
+            stack[-1][1].append(result)
 
 class ExtractSettings(object):
 
@@ -388,11 +480,7 @@ class ExtractSettings(object):
         self.rotation = rotation
         self.details = details
         if uax29 is not None:
-            icu = unicode_support.get_icu()
-            if uax29 is True:
-                uax29 = icu.Locale('en-US-POSIX')
-            else:
-                uax29 = icu.Locale(uax29)
+            uax29 = unicode_support.get_locale(uax29)
         self.uax29 = uax29
         self.html5 = html5
         self.fix_utf8 = fix_utf8
@@ -415,23 +503,26 @@ def extract_tesseract_bbox_data(node):
         for i, ch in enumerate(chars):
             yield ch, (x0 + w * i // n, y0, x0 + w * (i + 1) // n, y1), -1
 
+def _sanitize(stream):
+    # Fix UTF-8 encoding and get rid of control characters that are not
+    # allowed in XML.
+    #
+    # Ideally, this should never be needed, but some OCR engines produce
+    # such broken HTML:
+    #  * https://bugs.launchpad.net/cuneiform-linux/+bug/585418
+    #  * https://groups.google.com/d/topic/tesseract-issues/NlYJA3GNDMI
+    #
+    # Moreover, the HTML parsers trip over such errors:
+    #  * https://bugs.launchpad.net/lxml/+bug/690110
+    #  * https://bugs.debian.org/671842
+    #
+    # FIXME: This work-around is ugly and should be dropped at some point.
+    contents = stream.read()
+    return utils.sanitize_utf8(contents)
+
 def read_document(stream, settings):
     if settings.fix_utf8:
-        # Fix UTF-8 encoding and get rid of control characters that are not
-        # allowed in XML.
-        #
-        # Ideally, this should never be needed, but some OCR engines produce
-        # such broken HTML:
-        #  * https://bugs.launchpad.net/cuneiform-linux/+bug/585418
-        #  * https://groups.google.com/d/topic/tesseract-issues/NlYJA3GNDMI
-        #
-        # Moreover, the HTML parsers trip over such errors:
-        #  * https://bugs.launchpad.net/lxml/+bug/690110
-        #  * https://bugs.debian.org/671842
-        #
-        # FIXME: This work-around is ugly and should be dropped at some point.
-        contents = stream.read()
-        contents = utils.sanitize_utf8(contents)
+        contents = _sanitize(stream)
         if settings.html5:
             return html5_support.parse(contents)
         else:
@@ -443,18 +534,21 @@ def read_document(stream, settings):
     else:
         return etree.parse(stream, etree.HTMLParser())
 
-def extract_text(stream, **kwargs):
+def iterparse_document(stream, settings):
     '''
-    Extract DjVu text from an hOCR stream.
-
-    details: TEXT_DETAILS_LINES or TEXT_DETAILS_WORD or TEXT_DETAILS_CHAR
-    uax29: None or a PyICU locale
+    Parse the document incrementally; return an iterator over (event, element)
+    pairs, for the start and the end of each element.
     '''
-    settings = ExtractSettings(**kwargs)
-    doc = read_document(stream, settings)
-    ocr_system = doc.find('/head/meta[@name="ocr-system"]')
+    encoding = None
+    if settings.fix_utf8:
+        stream = io.BytesIO(_sanitize(stream))
+        encoding = 'UTF-8'
+    return etree.iterparse(stream, events=('start', 'end'), html=True, encoding=encoding)
+
+def detect_ocr_system(root, settings):
+    ocr_system = root.find('head/meta[@name="ocr-system"]')
     if ocr_system is None:
-        if doc.find('/head/meta[@name="ocr-capabilities"]') is None:
+        if root.find('head/meta[@name="ocr-capabilities"]') is None:
             # This is wild guess. However, since ocr-system is a required meta
             # tag, the hOCR we are processing is broken anyway.
             settings.cuneiform = (0, 8)
@@ -462,17 +556,143 @@ def extract_text(stream, **kwargs):
         settings.cuneiform = (0, 9)
     elif ocr_system.get('content').split()[0] == 'tesseract':
         settings.tesseract = True
-    if settings.details < TEXT_DETAILS_WORD or (settings.uax29 and settings.details <= text_zones.TEXT_DETAILS_WORD):
-        tesseract_bbox_data = doc.find('//script[@type="application/x-ocrodjvu-tesseract"]')
+
+def _needs_bbox_data(settings):
+    return settings.details < TEXT_DETAILS_WORD or (settings.uax29 and settings.details <= text_zones.TEXT_DETAILS_WORD)
+
+_tesseract_bbox_data_type = 'application/x-ocrodjvu-tesseract'
+
+def _scan_document(stream, settings):
+    '''
+    Return an iterator over top-level text zones of the hOCR document.
+
+    Unless the whole document has to be parsed first, the zones are scanned
+    lazily.
+    '''
+    streaming = not settings.html5
+    if streaming and _needs_bbox_data(settings):
+        # Bounding boxes of characters, if any, are appended after the text,
+        # so the whole document is needed before scanning can begin.
+        contents = stream.read()
+        streaming = _tesseract_bbox_data_type not in contents
+        stream = io.BytesIO(contents)
+        del contents
+    if streaming:
+        return iterscan(iterparse_document(stream, settings), settings)
+    with stats.timer('hocr-parse'):
+        doc = read_document(stream, settings)
+    detect_ocr_system(doc.getroot(), settings)
+    if _needs_bbox_data(settings):
+        tesseract_bbox_data = doc.find('//script[@type="{0}"]'.format(_tesseract_bbox_data_type))
         if tesseract_bbox_data is not None:
             settings.tesseract = True
             tesseract_bbox_data = extract_tesseract_bbox_data(tesseract_bbox_data)
             settings.bbox_data = tesseract_bbox_data
-    scan_result = scan(doc.find('/body'), settings)
-    return [zone.sexpr for zone in scan_result]
+    return _check_top_level(_scan(doc.find('/body'), settings, settings.page_size), settings)
+
+def _get_body_root(node):
+    if node.tag != 'body':
+        return
+    root = node.getparent()
+    if root is None or root.getparent() is not None:
+        return
+    return root
+
+def _get_fragment_head(root):
+    head = ['<html><head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">']
+    for meta in root.iterfind('head/meta'):
+        if meta.get('name') in ('ocr-system', 'ocr-capabilities'):
+            head += [etree.tostring(meta, method='html', encoding='UTF-8', with_tail=False)]
+    head += ['</head>']
+    return str.join('', head)
+
+def split_document(stream, **kwargs):
+    '''
+    Split a multi-page hOCR stream into single-page hOCR documents, which
+    extract_text() can process independently, with the same options.
+
+    Documents that cannot be split are yielded whole.
+    '''
+    settings = ExtractSettings(**kwargs)
+    streaming = not settings.html5
+    if streaming and _needs_bbox_data(settings):
+        contents = stream.read()
+        streaming = _tesseract_bbox_data_type not in contents
+        stream = io.BytesIO(contents)
+        del contents
+    if not streaming:
+        yield stream.read()
+        return
+    body = None
+    for event, node in iterparse_document(stream, settings):
+        if body is None:
+            if event == 'start':
+                root = _get_body_root(node)
+                if root is not None:
+                    body = node
+                    detect_ocr_system(root, settings)
+                    _, _, body_class, _ = _classify(body, settings, settings.page_size)
+                    head = _get_fragment_head(root)
+            continue
+        if event != 'end':
+            continue
+        if node is body:
+            if body_class:
+                yield head + etree.tostring(body, method='html', encoding='UTF-8', with_tail=False) + '</html>'
+            else:
+                items = _get_children(body, lambda child: [])
+                list(_check_top_level(items, settings))
+            return
+        if not body_class and node.getparent() is body:
+            items = _pop_preceding_text(body, node)
+            list(_check_top_level(items, settings))
+            yield '{head}<body>{page}</body></html>'.format(
+                head=head,
+                page=etree.tostring(node, method='html', encoding='UTF-8', with_tail=False),
+            )
+
+def extract_zones(stream, **kwargs):
+    '''
+    Extract text zones of pages from an hOCR stream.
+
+    details: TEXT_DETAILS_LINES or TEXT_DETAILS_WORD or TEXT_DETAILS_CHAR
+    uax29: None or a PyICU locale
+    '''
+    settings = ExtractSettings(**kwargs)
+    zones = _scan_document(stream, settings)
+    with stats.timer('hocr-scan'):
+        return list(zones)
+
+def iter_zones(stream, **kwargs):
+    '''
+    Like extract_zones(), but yield text zones of each page as soon as they
+    are available.
+    '''
+    settings = ExtractSettings(**kwargs)
+    for zone in _scan_document(stream, settings):
+        yield zone
+
+def extract_text(stream, **kwargs):
+    '''
+    Extract DjVu text from an hOCR stream.
+
+    details: TEXT_DETAILS_LINES or TEXT_DETAILS_WORD or TEXT_DETAILS_CHAR
+    uax29: None or a PyICU locale
+    '''
+    zones = extract_zones(stream, **kwargs)
+    with stats.timer('sexpr'):
+        return [zone.sexpr for zone in zones]
+
+def iter_text(stream, **kwargs):
+    '''
+    Like extract_text(), but yield DjVu text of each page as soon as it is
+    available.
+    '''
+    for zone in iter_zones(stream, **kwargs):
+        yield zone.sexpr
 
 __all__ = [
-    'extract_text',
+    'extract_zones', 'iter_zones', 'extract_text', 'iter_text', 'split_document',
     'TEXT_DETAILS_LINE', 'TEXT_DETAILS_WORD', 'TEXT_DETAILS_CHARACTER'
 ]
 
@@ -130,10 +130,11 @@ class Subprocess(subprocess.Popen):
         if return_code < 0:
             raise CalledProcessInterrupted(-return_code, self.__command)
 
-# PIPE
-# ====
+# PIPE, STDOUT
+# ============
 
 PIPE = subprocess.PIPE
+STDOUT = subprocess.STDOUT
 
 # DEVNULL
 # =======
@@ -143,16 +144,22 @@ try:
 except AttributeError:
     DEVNULL = open(os.devnull, 'rw')
 
-# require()
-# =========
+# which(), require()
+# ==================
 
-def require(command):
-    directories = os.environ['PATH'].split(os.pathsep)
+def which(command):
+    if os.path.dirname(command):
+        directories = ['']
+    else:
+        directories = os.environ['PATH'].split(os.pathsep)
     for directory in directories:
         path = os.path.join(directory, command)
         if os.access(path, os.X_OK):
-            return
-    raise OSError(errno.ENOENT, 'command not found', command)
+            return path
+
+def require(command):
+    if which(command) is None:
+        raise OSError(errno.ENOENT, 'command not found', command)
 
 # logging support
 # ===============
@@ -164,8 +171,8 @@ logger = logging.getLogger('ocrodjvu.ipc')
 
 __all__ = [
     'CalledProcessError', 'CalledProcessInterrupted',
-    'Subprocess', 'PIPE', 'DEVNULL',
-    'require',
+    'Subprocess', 'PIPE', 'STDOUT', 'DEVNULL',
+    'require', 'which',
 ]
 
 # vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,190 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''on-disk cache of OCR engine probe results'''
+
+import errno
+import json
+import os
+import sys
+import threading
+
+from . import errors
+from . import ipc
+from . import temporary
+
+# Probes can fail only in these ways;
+# other exceptions are never cached.
+_cached_errors = (
+    errors.EngineNotFound,
+    errors.UnknownLanguageList,
+)
+
+def _from_json(obj):
+    # Python 2 json module decodes all strings as unicode,
+    # but the probed executables deal with byte strings.
+    if isinstance(obj, unicode):
+        return obj.encode('UTF-8')
+    if isinstance(obj, list):
+        return [_from_json(item) for item in obj]
+    if isinstance(obj, dict):
+        return dict(
+            (_from_json(key), _from_json(value))
+            for key, value in obj.iteritems()
+        )
+    return obj
+
+def is_enabled():
+    return os.environ.get('OCRODJVU_PROBE_CACHE') != '0'
+
+def get_path():
+    directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(directory, 'ocrodjvu', 'probes.json')
+
+class ProbeCache(object):
+
+    '''
+    Results of probing OCR engine executables, keyed by the executable path
+    and the probe name, and valid as long as the executable's size and
+    modification time don't change.
+
+    Errors reading or writing the cache file are ignored: in the worst case,
+    the executables are probed again.
+
+    The cache is bypassed if the OCRODJVU_PROBE_CACHE environment variable
+    is set to 0.
+    '''
+
+    def __init__(self, path=None):
+        self._path = path
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._path is None:
+            self._path = get_path()
+        try:
+            with open(self._path, 'rb') as file:
+                data = json.load(file)
+        except (IOError, ValueError):
+            data = None
+        if not isinstance(data, dict):
+            data = {}
+        self._data = _from_json(data)
+
+    def _save(self):
+        directory = os.path.dirname(self._path)
+        try:
+            try:
+                os.makedirs(directory)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+            with temporary.file(dir=directory, suffix='.tmp', delete=False) as file:
+                json.dump(self._data, file, sort_keys=True)
+            # Renaming is atomic, so other processes never see partially
+            # written file.
+            os.rename(file.name, self._path)
+        except (IOError, OSError):
+            pass
+
+    def call(self, executable, name, function, *args):
+        '''
+        Return (or raise) the cached result of function(*args), which probes
+        the executable.
+
+        The name identifies the probe. It can be any JSON-serializable object,
+        so that it can include e.g. relevant environment variables.
+
+        The result must be serializable as JSON. Tuples are turned into
+        lists, even if the result was not cached before.
+        '''
+        if not is_enabled():
+            return function(*args)
+        path = ipc.which(executable)
+        if path is None:
+            return function(*args)
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        key = json.dumps([path, name, args])
+        stamp = [st.st_size, st.st_mtime]
+        with self._lock:
+            if self._data is None:
+                self._load()
+            entry = self._data.get(key)
+        if isinstance(entry, dict) and entry.get('stamp') == stamp:
+            if 'error' in entry:
+                # The message is already formatted.
+                cls = getattr(errors, entry['error'])
+                raise errors._rebuild_exception(cls, entry['args'])
+            return entry['result']
+        entry = dict(stamp=stamp)
+        try:
+            entry['result'] = _from_json(json.loads(json.dumps(function(*args))))
+        except _cached_errors as ex:
+            entry['error'] = type(ex).__name__
+            entry['args'] = list(ex.args)
+            raise
+        finally:
+            with self._lock:
+                if 'result' in entry or 'error' in entry:
+                    self._data[key] = entry
+                    self._save()
+        return entry['result']
+
+_cache = ProbeCache()
+
+def cached(executable, name, function, *args):
+    '''
+    Return (or raise) the cached result of function(*args), which probes the
+    executable.
+    '''
+    return _cache.call(executable, name, function, *args)
+
+def run_parallel(functions):
+    '''
+    Call the functions in separate threads. Return list of their results,
+    or re-raise the first exception (in the order of the functions).
+
+    This is meant for probes that are independent of each other, so that
+    running them at the same time doesn't change their results.
+    '''
+    functions = list(functions)
+    if len(functions) == 1:
+        [function] = functions
+        return [function()]
+    results = [None] * len(functions)
+    exc_infos = [None] * len(functions)
+    def run(i, function):
+        try:
+            results[i] = function()
+        except Exception:
+            exc_infos[i] = sys.exc_info()
+    threads = [
+        threading.Thread(target=run, args=(i, fn))
+        for i, fn in enumerate(functions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for exc_info in exc_infos:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return results
+
+__all__ = ['ProbeCache', 'cached', 'get_path', 'is_enabled', 'run_parallel']
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,180 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''timing of processing stages'''
+
+import collections
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+_local = threading.local()
+
+class Stats(object):
+
+    '''
+    Timings of processing stages, appended to a file as JSON lines.
+
+    Many processes can write to the same file at once.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, document=None, page=None):
+        record = dict(
+            type='timing',
+            stage=stage,
+            seconds=seconds,
+            document=document,
+            page=page,
+        )
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+@contextlib.contextmanager
+def pages(stats, document, numbers):
+    '''
+    Attribute timings in this thread to the pages (or to the whole document,
+    if numbers is None).
+    '''
+    if stats is None:
+        yield
+        return
+    saved = getattr(_local, 'context', None)
+    _local.context = stats, document, numbers
+    try:
+        yield
+    finally:
+        _local.context = saved
+
+@contextlib.contextmanager
+def subset(numbers):
+    '''
+    Attribute timings in this thread only to some of the current pages.
+    '''
+    context = getattr(_local, 'context', None)
+    if context is None:
+        yield
+        return
+    stats, document, _ = context
+    with pages(stats, document, numbers):
+        yield
+
+@contextlib.contextmanager
+def timer(stage):
+    '''
+    Measure time spent in this stage, and split it evenly between the current
+    pages.
+    '''
+    context = getattr(_local, 'context', None)
+    if context is None:
+        yield
+        return
+    stats, document, numbers = context
+    start = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        if numbers is None:
+            stats.add(stage, seconds, document=document)
+        else:
+            for n in numbers:
+                stats.add(stage, seconds / len(numbers), document=document, page=n)
+
+def percentile(values, p):
+    '''
+    Return the p-th percentile of the sorted values (using the nearest-rank
+    method).
+    '''
+    k = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(k, 0)]
+
+_percentiles = 50, 90, 99
+
+def summarize(path):
+    '''
+    Compute totals and percentiles for each stage from a JSON lines file.
+    '''
+    values = collections.defaultdict(list)
+    with open(path, 'rb') as file:
+        for line in file:
+            record = json.loads(line)
+            if record['type'] != 'timing':
+                continue
+            values[record['stage']] += [record['seconds']]
+    summary = []
+    for stage, stage_values in sorted(values.iteritems()):
+        stage_values.sort()
+        item = collections.OrderedDict([
+            ('type', 'summary'),
+            ('stage', stage),
+            ('count', len(stage_values)),
+            ('total', sum(stage_values)),
+        ])
+        for p in _percentiles:
+            item['p{0}'.format(p)] = percentile(stage_values, p)
+        item['max'] = stage_values[-1]
+        summary += [item]
+    return summary
+
+def write_summary(summary, file):
+    for item in summary:
+        file.write(json.dumps(item) + '\n')
+
+def write_prometheus(summary, path):
+    '''
+    Write the summary in the Prometheus text exposition format.
+
+    The file is replaced atomically, so that it can be read by the textfile
+    collector at any time.
+    '''
+    name = 'ocrodjvu_stage_seconds'
+    lines = [
+        '# HELP {0} Time spent in processing stages.'.format(name),
+        '# TYPE {0} summary'.format(name),
+    ]
+    for item in summary:
+        stage = item['stage']
+        for p in _percentiles:
+            lines += ['{name}{{stage="{stage}",quantile="{q}"}} {value!r}'.format(
+                name=name, stage=stage, q=(p / 100.0), value=item['p{0}'.format(p)]
+            )]
+        lines += ['{name}_sum{{stage="{stage}"}} {value!r}'.format(name=name, stage=stage, value=item['total'])]
+        lines += ['{name}_count{{stage="{stage}"}} {value}'.format(name=name, stage=stage, value=item['count'])]
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        for line in lines:
+            file.write(line + '\n')
+    os.rename(tmp_path, path)
+
+__all__ = [
+    'Stats',
+    'pages', 'subset', 'timer',
+    'percentile', 'summarize', 'write_summary', 'write_prometheus',
+]
+
+# vim:ts=4 sts=4 sw=4 et
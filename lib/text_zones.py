@@ -21,70 +21,85 @@ except ImportError:
 else:  # no coverage
     set_dll_search_path()
 
+import re
+
 from . import utils
 
 try:
     from djvu import const
-    from djvu import decode
     from djvu import sexpr
 except ImportError as ex:  # no coverage
     utils.enhance_import_error(ex, 'python-djvulibre', 'python-djvu', 'https://jwilk.net/software/python-djvulibre')
     raise
 
+try:
+    import numpy
+except ImportError:  # no coverage
+    numpy = None
+
 TEXT_DETAILS_LINE = const.TEXT_ZONE_LINE
 TEXT_DETAILS_WORD = const.TEXT_ZONE_WORD
 TEXT_DETAILS_CHARACTER = const.TEXT_ZONE_CHARACTER
 
 class BBox(object):
 
-    def __init__(self, x0=None, y0=None, x1=None, y1=None):
-        self._coordinates = [x0, y0, x1, y1]
-
-    @property
-    def x0(self):
-        return self[0]
-
-    @property
-    def y0(self):
-        return self[1]
+    __slots__ = ('x0', 'y0', 'x1', 'y1')
 
-    @property
-    def x1(self):
-        return self[2]
-
-    @property
-    def y1(self):
-        return self[3]
+    def __init__(self, x0=None, y0=None, x1=None, y1=None):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
 
     def __getitem__(self, item):
-        return self._coordinates[item]
+        return (self.x0, self.y0, self.x1, self.y1)[item]
+
+    def __iter__(self):
+        return iter((self.x0, self.y0, self.x1, self.y1))
 
     def __nonzero__(self):
-        for value in self._coordinates:
-            if value is None:
-                return False
-        return True
+        return (
+            self.x0 is not None and
+            self.y0 is not None and
+            self.x1 is not None and
+            self.y1 is not None
+        )
 
     def __repr__(self):
         return '{cls}({0!r}, {1!r}, {2!r}, {3!r})'.format(
-            *self._coordinates,
+            self.x0, self.y0, self.x1, self.y1,
             cls=type(self).__name__
         )
 
     def update(self, bbox):
-        for i, self_i in enumerate(self._coordinates):
-            if self_i is None:
-                self._coordinates[i] = bbox[i]
-            elif i < 2 and bbox[i] is not None and self[i] > bbox[i]:
-                self._coordinates[i] = bbox[i]
-            elif i > 1 and bbox[i] is not None and self[i] < bbox[i]:
-                self._coordinates[i] = bbox[i]
+        x0, y0, x1, y1 = bbox
+        if self.x0 is None:
+            self.x0 = x0
+        elif x0 is not None and self.x0 > x0:
+            self.x0 = x0
+        if self.y0 is None:
+            self.y0 = y0
+        elif y0 is not None and self.y0 > y0:
+            self.y0 = y0
+        if self.x1 is None:
+            self.x1 = x1
+        elif x1 is not None and self.x1 < x1:
+            self.x1 = x1
+        if self.y1 is None:
+            self.y1 = y1
+        elif y1 is not None and self.y1 < y1:
+            self.y1 = y1
 
 class Space(object):
-    pass
+
+    __slots__ = ()
 
 class Zone(object):
 
+    # Pages with character details have lots of zones, so don't waste memory
+    # on per-instance dictionaries.
+    __slots__ = ('type', '_bbox', 'children')
+
     def __init__(self, type, bbox=None, children=()):
         self.type = type
         self.bbox = bbox
@@ -101,13 +116,7 @@ class Zone(object):
 
     bbox = property(get_bbox, set_bbox)
 
-    @property
-    def sexpr(self):
-        children = [
-            child.sexpr if isinstance(child, Zone) else child
-            for child in self.children
-            if not isinstance(child, Space)
-        ] or ['']
+    def _get_sexpr_bbox(self):
         x0, y0, x1, y1 = self.bbox
         if x0 > x1:
             x0, x1 = x1, x0
@@ -119,11 +128,58 @@ class Zone(object):
             y1 += 1
         assert x0 < x1
         assert y0 < y1
+        return x0, y0, x1, y1
+
+    def _get_sexpr_children(self):
+        return [
+            child
+            for child in self.children
+            if not isinstance(child, Space)
+        ] or ['']
+
+    @property
+    def sexpr(self):
+        children = [
+            child.sexpr if isinstance(child, Zone) else child
+            for child in self._get_sexpr_children()
+        ]
         return sexpr.Expression(
-            [self.type, x0, y0, x1, y1] +
+            [self.type] + list(self._get_sexpr_bbox()) +
             children
         )
 
+    def _format(self):
+        items = [str(self.type)]
+        items += [str(x) for x in self._get_sexpr_bbox()]
+        items += [
+            child._format() if isinstance(child, Zone) else _format_string(child)[0]
+            for child in self._get_sexpr_children()
+        ]
+        return '({0})'.format(str.join(' ', items))
+
+    def _layout(self):
+        items = [(str(self.type), len(str(self.type)), None)]
+        items += [(str(x), len(str(x)), None) for x in self._get_sexpr_bbox()]
+        items += [
+            child._layout() if isinstance(child, Zone) else _format_string(child) + (None,)
+            for child in self._get_sexpr_children()
+        ]
+        text = '({0})'.format(str.join(' ', (item[0] for item in items)))
+        width = len(items) + 1 + sum(item[1] for item in items)
+        return text, width, items
+
+    def print_into(self, file, width=None):
+        '''
+        Print the zone into the file, exactly as print_sexpr(self.sexpr,
+        file, width) would, but without building the S-expression first.
+        '''
+        if width is None:
+            file.write(self._format())
+            return
+        output = []
+        _pretty_print(self._layout(), output, 0, width)
+        file.write(str.join('', output))
+
     def __iter__(self):
         return iter(self.children)
 
@@ -148,34 +204,82 @@ class Zone(object):
             chld=self.children,
         )
 
-    def rotate(self, rotation, xform=None):
-        for x in self.bbox:
-            assert x is not None
-        if xform is None:
-            assert self.type == const.TEXT_ZONE_PAGE, (
-                'the exterior zone is {tp} rather than {pg}'.format(tp=self.type, pg=const.TEXT_ZONE_PAGE)
-            )
-            assert self.bbox[:2] == (0, 0), (
-                'top-left page corner is ({0}, {1}) rather than (0, 0)'.format(*self.bbox[:2])
-            )
-            page_size = self.bbox[2:]
-            if (rotation // 90) & 1:
-                xform = decode.AffineTransform((0, 0) + tuple(reversed(page_size)), (0, 0) + page_size)
+    def rotate(self, rotation):
+        assert self.type == const.TEXT_ZONE_PAGE, (
+            'the exterior zone is {tp} rather than {pg}'.format(tp=self.type, pg=const.TEXT_ZONE_PAGE)
+        )
+        assert self.bbox[:2] == (0, 0), (
+            'top-left page corner is ({0}, {1}) rather than (0, 0)'.format(*self.bbox[:2])
+        )
+        w, h = self.bbox[2:]
+        # This is the inverse of djvu.decode.AffineTransform for the page, with
+        # mirror_y() and rotate(rotation) applied. As the rotation is a
+        # multiple of 90 degrees, the mapping boils down to swapping and
+        # mirroring integer coordinates.
+        rotation = (rotation // 90) & 3
+        zones = [self]
+        while zones:
+            zone = zones.pop()
+            x0, y0, x1, y1 = bbox = zone._bbox
+            assert None not in bbox
+            if rotation == 0:
+                y0, y1 = h - y0, h - y1
+            elif rotation == 1:
+                x0, y0, x1, y1 = h - y0, w - x0, h - y1, w - x1
+            elif rotation == 2:
+                x0, x1 = w - x0, w - x1
             else:
-                xform = decode.AffineTransform((0, 0) + page_size, (0, 0) + page_size)
-            xform.mirror_y()
-            xform.rotate(rotation)
-        x0, y0, x1, y1 = self.bbox
-        x0, y0 = xform.inverse((x0, y0))
-        x1, y1 = xform.inverse((x1, y1))
-        if x0 > x1:
-            x0, x1 = x1, x0
-        if y0 > y1:
-            y0, y1 = y1, y0
-        self.bbox = x0, y0, x1, y1
-        for child in self:
-            if isinstance(child, Zone):
-                child.rotate(rotation, xform)
+                x0, y0, x1, y1 = y0, x0, y1, x1
+            if x0 > x1:
+                x0, x1 = x1, x0
+            if y0 > y1:
+                y0, y1 = y1, y0
+            zone._bbox = x0, y0, x1, y1
+            zones += [child for child in zone.children if isinstance(child, Zone)]
+
+def _get_bboxes_numpy(coordinates, spans):
+    indices = numpy.array(spans).ravel()
+    if indices[-1] == len(coordinates):
+        # The last span extends to the end, which reduceat() does anyway.
+        indices = indices[:-1]
+    x0y0 = numpy.minimum.reduceat(coordinates[:, :2], indices, axis=0)
+    x1y1 = numpy.maximum.reduceat(coordinates[:, 2:], indices, axis=0)
+    return numpy.hstack((x0y0[::2], x1y1[::2])).tolist()
+
+def get_bboxes(coordinates, spans):
+    '''
+    Return bounding boxes of the spans of coordinates.
+
+    coordinates: list of (x0, y0, x1, y1)
+    spans: list of (i, j) pairs, such that i < j
+    '''
+    if numpy is not None and spans:
+        try:
+            array = numpy.array(coordinates, dtype=int)
+        except TypeError:
+            # Some coordinates are missing.
+            pass
+        else:
+            return _get_bboxes_numpy(array, spans)
+    bboxes = []
+    for i, j in spans:
+        bbox = BBox()
+        for k in xrange(i, j):
+            bbox.update(coordinates[k])
+        bboxes += [bbox]
+    return bboxes
+
+def get_word_spans(text, word_break_iterator):
+    '''
+    Return (i, j) pairs, such that text[i:j] are the words of the text.
+    '''
+    spans = []
+    i = 0
+    for j in word_break_iterator(text):
+        if not text[i:j].isspace():
+            spans += [(i, j)]
+        i = j
+    return spans
 
 def group_words(zones, details, word_break_iterator):
     text = str.join('', (z[0] for z in zones))
@@ -183,44 +287,37 @@ def group_words(zones, details, word_break_iterator):
         # One zone per line
         return [text]
     # One zone per word
-    split_zones = []
+    coordinates = []
     for zone in zones:
         zone_text = zone[0]
+        if not isinstance(zone, Zone):
+            # Whitespace between zones; it never makes up a word.
+            coordinates += [(0, 0, 0, 0)] * len(zone_text)
+            continue
         if len(zone_text) == 1:
-            split_zones += [zone]
+            coordinates += [zone.bbox]
             continue
         x0, y0, x1, y1 = zone.bbox
         w = x1 - x0
         m = len(zone_text)
-        split_zones += [
-            Zone(zone.type, BBox(x0 + w * n // m, y0, x0 + w * (n + 1) // m, y1))
-            for n, ch in enumerate(zone_text)
+        coordinates += [
+            (x0 + w * n // m, y0, x0 + w * (n + 1) // m, y1)
+            for n in xrange(m)
         ]
         del x0, y0, x1, y1  # quieten pyflakes
-    zones = split_zones
-    del split_zones
-    assert len(text) == len(zones)
+    assert len(text) == len(coordinates)
+    spans = get_word_spans(text, word_break_iterator)
     words = []
-    i = 0
-    for j in word_break_iterator(text):
-        subtext = text[i:j]
-        if subtext.isspace():
-            i = j
-            continue
-        bbox = BBox()
-        for k in xrange(i, j):
-            bbox.update(zones[k].bbox)
+    for (i, j), bbox in zip(spans, get_bboxes(coordinates, spans)):
         last_word = Zone(type=const.TEXT_ZONE_WORD, bbox=bbox)
         words += [last_word]
         if details > TEXT_DETAILS_CHARACTER:
-            last_word += [subtext]
+            last_word += [text[i:j]]
         else:
             last_word += [
-                Zone(type=const.TEXT_ZONE_CHARACTER, bbox=(x0, y0, x1, y1), children=[ch])
+                Zone(type=const.TEXT_ZONE_CHARACTER, bbox=coordinates[k], children=[text[k]])
                 for k in xrange(i, j)
-                for (x0, y0, x1, y1), ch in [(zones[k].bbox, text[k])]
             ]
-        i = j
     return words
 
 try:
@@ -229,9 +326,72 @@ except TypeError:
     # python-djvulibre << 0.4
     def print_sexpr(expr, file, width=None):
         return expr.print_into(file, width=width)
+    _escape_unicode = True
 else:
     # python-djvulibre >= 0.4
     def print_sexpr(expr, file, width=None):
         return expr.print_into(file, width=width, escape_unicode=False)
+    _escape_unicode = False
+
+# The functions below mimic the S-expression printer of DjVuLibre.
+
+_ascii = str(bytearray(xrange(0x80)))
+_string_escapes = {
+    '"': r'\"',
+    '\\': r'\\',
+    '\t': r'\t',
+    '\n': r'\n',
+    '\r': r'\r',
+    '\b': r'\b',
+    '\f': r'\f',
+}
+
+def _escape_char(match):
+    ch = match.group()
+    try:
+        return _string_escapes[ch]
+    except KeyError:
+        return '\\{0:03o}'.format(ord(ch))
+
+if _escape_unicode:
+    _string_escape_re = re.compile(r'[\x00-\x1F"\\\x7F-\xFF]')
+else:
+    _string_escape_re = re.compile(r'[\x00-\x1F"\\\x7F]')
+
+def _format_string(s):
+    '''
+    Return the S-expression representation of the string, and its width
+    as seen by the DjVuLibre line-breaking algorithm, which assumes that
+    non-ASCII bytes are always escaped.
+    '''
+    if isinstance(s, unicode):
+        s = s.encode('UTF-8')
+    s = '"{0}"'.format(_string_escape_re.sub(_escape_char, s))
+    return s, len(s) + 3 * len(s.translate(None, _ascii))
+
+def _pretty_print(item, output, column, width):
+    text, text_width, subitems = item
+    if subitems is None or column + text_width < width:
+        output += [text]
+        return column + len(text)
+    indent = column + 2
+    head = subitems[0][0]
+    output += ['(', head]
+    column += 1 + len(head)
+    multiline = False
+    for subitem in subitems[1:]:
+        if not multiline and column + 1 + subitem[1] < width:
+            output += [' ', subitem[0]]
+            column += 1 + len(subitem[0])
+            continue
+        multiline = True
+        output += [' \n', ' ' * indent]
+        column = _pretty_print(subitem, output, indent, width)
+    if multiline:
+        output += [' )']
+        return column + 2
+    else:
+        output += [')']
+        return column + 1
 
 # vim:ts=4 sts=4 sw=4 et
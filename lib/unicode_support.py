@@ -13,6 +13,10 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import re
+import sys
+import threading
+
 from . import utils
 
 def get_icu():
@@ -24,18 +28,51 @@ def get_icu():
     else:
         return icu
 
+_locales = {}
+
+def get_locale(name):
+    '''
+    Return ICU locale with the given name (or the POSIX locale, if name is
+    True).
+    '''
+    if name is True:
+        name = 'en-US-POSIX'
+    try:
+        return _locales[name]
+    except KeyError:
+        icu = get_icu()
+        locale = _locales[name] = icu.Locale(name)
+        return locale
+
+_simple_word_re = re.compile(r'\s+|\S+')
+_simple_word_re_unicode = re.compile(r'\s+|\S+', re.UNICODE)
+
 def simple_word_break_iterator(text):
     '''
     Create an instance of simple space-to-space word break iterator.
     '''
-    if not text:
-        return
-    space = text[0].isspace()
-    for n, ch in enumerate(text):
-        if space != ch.isspace():
-            yield n
-            space = not space
-    yield len(text)
+    if isinstance(text, unicode):
+        regex = _simple_word_re_unicode
+    else:
+        regex = _simple_word_re
+    for match in regex.finditer(text):
+        yield match.end()
+
+_local = threading.local()
+
+def _get_icu_break_iterator(locale):
+    # Break iterators are not thread-safe, so every thread has its own.
+    try:
+        cache = _local.break_iterators
+    except AttributeError:
+        cache = _local.break_iterators = {}
+    key = locale.getName()
+    try:
+        return cache[key]
+    except KeyError:
+        icu = get_icu()
+        break_iterator = cache[key] = icu.BreakIterator.createWordInstance(locale)
+        return break_iterator
 
 def word_break_iterator(text, locale=None):
     '''
@@ -46,9 +83,43 @@ def word_break_iterator(text, locale=None):
     '''
     if locale is None:
         return simple_word_break_iterator(text)
-    icu = get_icu()
-    break_iterator = icu.BreakIterator.createWordInstance(locale)
+    break_iterator = _get_icu_break_iterator(locale)
     break_iterator.setText(text)
-    return break_iterator
+    return list(break_iterator)
+
+if sys.maxunicode > 0xFFFF:
+    _astral_re = re.compile(u'[\U00010000-\U0010FFFF]')
+    def _utf16_len(text):
+        return len(text) + len(_astral_re.findall(text))
+else:  # no coverage
+    _utf16_len = len
+
+# Paragraph separator: UAX #29 always allows word breaks before and after it.
+_text_separator = u'\u2029'
+
+def word_breaks(texts, locale=None):
+    '''
+    Segment the texts into words, all of them at once.
+
+    Return a list of lists of offsets, the same as word_break_iterator()
+    would yield for each text.
+    '''
+    if locale is None:
+        return [list(simple_word_break_iterator(text)) for text in texts]
+    # ICU reports offsets in UTF-16 code units.
+    breaks = word_break_iterator(_text_separator.join(texts), locale)
+    result = []
+    i = 0
+    start = 0
+    for text in texts:
+        end = start + _utf16_len(text)
+        text_breaks = []
+        while i < len(breaks) and breaks[i] <= end:
+            if breaks[i] > start:
+                text_breaks += [breaks[i] - start]
+            i += 1
+        result += [text_breaks]
+        start = end + 1
+    return result
 
 # vim:ts=4 sts=4 sw=4 et
@@ -52,6 +52,22 @@ def parse_page_numbers(pages):
             result += [int(page_range, 10)]
     return result
 
+_size_suffixes = dict(k=1 << 10, m=1 << 20, g=1 << 30)
+
+def parse_size(size):
+    '''
+    parse_size('42') -> 42
+    parse_size('42k') -> 43008
+    parse_size('42M') -> 44040192
+    parse_size('1G') -> 1073741824
+    '''
+    multiplier = 1
+    suffix = size[-1:].lower()
+    if suffix in _size_suffixes:
+        multiplier = _size_suffixes[suffix]
+        size = size[:-1]
+    return int(size, 10) * multiplier
+
 _special_chars_replace = re.compile(ur'''[\x00-\x1F'"\x5C\x7F-\x9F]''').sub
 
 def _special_chars_escape(m):
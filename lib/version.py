@@ -56,6 +56,12 @@ class VersionAction(argparse.Action):
             pass
         else:
             print('+ html5lib-python {0}'.format(html5lib.__version__))
+        try:
+            numpy = sys.modules['numpy']
+        except LookupError:  # no coverage
+            pass
+        else:
+            print('+ NumPy {0}'.format(numpy.__version__))
         try:
             from . import unicode_support
             pyicu = unicode_support.get_icu()
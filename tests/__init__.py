@@ -0,0 +1,35 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+import shutil
+import tempfile
+
+_saved_environ = {}
+
+def setup_package():
+    # Don't let the tests touch the user's cache of OCR engine probes.
+    _saved_environ['XDG_CACHE_HOME'] = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp(prefix='ocrodjvu.tests.')
+
+def teardown_package():
+    shutil.rmtree(os.environ['XDG_CACHE_HOME'])
+    value = _saved_environ.pop('XDG_CACHE_HOME')
+    if value is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = value
+
+# vim:ts=4 sts=4 sw=4 et
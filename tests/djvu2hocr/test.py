@@ -17,6 +17,7 @@ import io
 import os
 import shlex
 import shutil
+import stat
 import sys
 
 from lib import ipc
@@ -66,7 +67,7 @@ def test_version():
     assert_equal(rc, 0)
     assert_not_equal(stdout.getvalue(), '')
 
-def _test_from_file(base_filename, index):
+def _test_from_file(base_filename, index, extra_args=()):
     base_filename = os.path.join(here, base_filename)
     test_filename = '{base}.test{i}'.format(base=base_filename, i=index)
     djvused_filename = base_filename + '.djvused'
@@ -75,6 +76,7 @@ def _test_from_file(base_filename, index):
         expected_output = file.read()
     args = shlex.split(commandline)
     assert_equal(args[0], '#')
+    args += extra_args
     with temporary.directory() as tmpdir:
         djvu_filename = os.path.join(tmpdir, 'empty.djvu')
         args += [djvu_filename]
@@ -108,6 +110,72 @@ def test_from_file():
         index = int(test_filename[-1])
         base_filename = os.path.basename(test_filename[:-6])
         yield _test_from_file, base_filename, index
+        yield _test_from_file, base_filename, index, ['-j', '2']
+
+def test_multiple_files():
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    with interim(sys, stdout=stdout, stderr=stderr):
+        rc = try_run(djvu2hocr.main, ['', 'eggs.djvu', 'ham.djvu'])
+    assert_equal(rc, errors.EXIT_FATAL)
+    assert_not_equal(stderr.getvalue(), '')
+    assert_equal(stdout.getvalue(), '')
+
+def test_files_from():
+    with temporary.directory() as tmpdir:
+        list_path = os.path.join(tmpdir, 'list')
+        with open(list_path, 'w') as file:
+            file.write('ham.djvu\n\nspam.djvu\n')
+        options = djvu2hocr.ArgumentParser().parse_args(['--output-dir', tmpdir, '--files-from', list_path, 'eggs.djvu'])
+    assert_equal(options.paths, ['eggs.djvu', 'ham.djvu', 'spam.djvu'])
+
+def test_get_output_path():
+    options = djvu2hocr.ArgumentParser().parse_args(['--output-dir', os.curdir, 'eggs.djvu'])
+    assert_equal(djvu2hocr.get_output_path('/tmp/eggs.djvu', options), os.path.join(os.curdir, 'eggs.html'))
+    options = djvu2hocr.ArgumentParser().parse_args(['--output-template', '{dirname}/{stem}.hocr', 'eggs.djvu'])
+    assert_equal(djvu2hocr.get_output_path('/tmp/eggs.djvu', options), '/tmp/eggs.hocr')
+    assert_equal(djvu2hocr.get_output_path('eggs.djvu', options), os.path.join(os.curdir, 'eggs.hocr'))
+
+def _test_batch(n_jobs):
+    path = os.path.join(here, '..', 'data', 'empty.djvu')
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    with temporary.directory() as tmpdir:
+        paths = []
+        for name in 'eggs', 'ham':
+            paths += [os.path.join(tmpdir, name + '.djvu')]
+            shutil.copy(path, paths[-1])
+        paths[1:1] = [os.path.join(tmpdir, 'nonexistent.djvu')]
+        args = ['', '-j', str(n_jobs), '--output-dir', tmpdir] + paths
+        with interim(sys, stdout=stdout, stderr=stderr):
+            with interim(djvu2hocr.logger, handlers=[]):
+                rc = try_run(djvu2hocr.main, args)
+        # The batch doesn't stop on the first failed file.
+        assert_equal(rc, errors.EXIT_NONFATAL)
+        # No temporary files are left behind:
+        assert_equal(
+            sorted(os.listdir(tmpdir)),
+            ['eggs.djvu', 'eggs.html', 'ham.djvu', 'ham.html'],
+        )
+        with open(os.path.join(tmpdir, 'eggs.html'), 'rb') as file:
+            assert_equal(file.read(), djvu2hocr.get_hocr_header(djvu2hocr.ArgumentParser().parse_args([path])) + djvu2hocr.hocr_footer)
+        mode = os.stat(os.path.join(tmpdir, 'eggs.html')).st_mode
+        assert_equal(stat.S_IMODE(mode), 0o666 & ~djvu2hocr.get_umask())
+    assert_equal(stdout.getvalue(), '')
+
+def test_batch():
+    yield _test_batch, 1
+    yield _test_batch, 2
+
+def test_output_path_clash():
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    paths = [os.path.join('eggs', 'spam.djvu'), os.path.join('ham', 'spam.djvu')]
+    with interim(sys, stdout=stdout, stderr=stderr):
+        rc = try_run(djvu2hocr.main, ['', '--output-dir', os.curdir] + paths)
+    assert_equal(rc, errors.EXIT_FATAL)
+    assert_not_equal(stderr.getvalue(), '')
+    assert_equal(stdout.getvalue(), '')
 
 def test_nonascii_path():
     require_locale_encoding('UTF-8')  # djvused breaks otherwise
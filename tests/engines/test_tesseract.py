@@ -0,0 +1,194 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+import os
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_in,
+    assert_raises,
+)
+
+from lib import temporary
+from lib import text_zones
+from lib.engines.tesseract import (
+    Engine,
+    split_hocr,
+    split_tsv,
+)
+from lib.errors import (
+    MalformedHocr,
+    MalformedOcrOutput,
+)
+
+here = os.path.dirname(__file__)
+here = os.path.relpath(here)
+
+tsv = (
+    'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n'
+    '1\t1\t0\t0\t0\t0\t0\t0\t100\t50\t-1\t\n'
+    '2\t1\t1\t0\t0\t0\t10\t10\t80\t30\t-1\t\n'
+    '3\t1\t1\t1\t0\t0\t10\t10\t80\t30\t-1\t\n'
+    '4\t1\t1\t1\t1\t0\t10\t10\t80\t12\t-1\t\n'
+    '5\t1\t1\t1\t1\t1\t10\t10\t30\t12\t95\teggs\n'
+    '5\t1\t1\t1\t1\t2\t50\t11\t40\t11\t94\tham\n'
+    '4\t1\t1\t1\t2\t0\t10\t28\t50\t12\t-1\t\n'
+    '5\t1\t1\t1\t2\t1\t10\t28\t50\t12\t90\tspam\n'
+    '5\t1\t1\t1\t2\t2\t60\t28\t5\t12\t0\t \n'
+    '4\t1\t1\t1\t3\t0\t10\t40\t5\t5\t-1\t\n'
+    '5\t1\t1\t1\t3\t1\t10\t40\t5\t5\t0\t \n'
+)
+
+class test_tesseract():
+
+    fake_executable = 'fake-tesseract'
+    version = (4, 1)
+
+    def get_engine(self, **kwargs):
+        return Engine(
+            executable=os.path.join(here, self.fake_executable),
+            use_hocr='1',
+            **kwargs
+        )
+
+    def test_version(self):
+        engine = self.get_engine()
+        assert_equal(engine.get_version(), self.version)
+        assert_equal(engine.use_pipe, self.version >= (4, 0))
+        assert_equal(engine.needs_image_file, not engine.use_pipe)
+
+    def _test_recognize(self, use_pipe, details):
+        engine = self.get_engine(use_pipe=use_pipe)
+        image = io.BytesIO('<p>eggs</p>')
+        result = engine.recognize(image, 'eng', details=details)
+        assert_equal(result.format, 'html')
+        assert_equal(str(result), '<html><body><p>eggs</p></body></html>')
+
+    def test_recognize_pipe(self):
+        self._test_recognize('1', text_zones.TEXT_DETAILS_WORD)
+
+    def test_recognize_file(self):
+        self._test_recognize('0', text_zones.TEXT_DETAILS_WORD)
+
+    def test_recognize_pipe_from_file(self):
+        engine = self.get_engine(use_pipe='1')
+        with temporary.file(suffix='.tif') as image:
+            image.write('<p>eggs</p>')
+            image.flush()
+            result = engine.recognize(image, 'eng', details=text_zones.TEXT_DETAILS_WORD)
+        assert_equal(str(result), '<html><body><p>eggs</p></body></html>')
+
+    def test_recognize_pipe_characters(self):
+        # Character details need a box file, so this falls back to temporary
+        # files.
+        engine = self.get_engine(use_pipe='1')
+        image = io.BytesIO('<p>eggs</p>')
+        result = engine.recognize(image, 'eng', details=text_zones.TEXT_DETAILS_CHARACTER)
+        assert_in('<p>eggs</p>', str(result))
+        assert_in('application/x-ocrodjvu-tesseract', str(result))
+
+    def _test_recognize_tsv(self, use_pipe):
+        engine = self.get_engine(use_pipe=use_pipe, use_tsv='1')
+        image = io.BytesIO(tsv)
+        result = engine.recognize(image, 'eng', details=text_zones.TEXT_DETAILS_WORD)
+        assert_equal(result.format, 'tsv')
+        assert_equal(str(result), tsv)
+
+    def test_recognize_tsv_pipe(self):
+        self._test_recognize_tsv('1')
+
+    def test_recognize_tsv_file(self):
+        self._test_recognize_tsv('0')
+
+    def test_recognize_tsv_characters(self):
+        # Character details need a box file, so this falls back to hOCR.
+        engine = self.get_engine(use_tsv='1')
+        image = io.BytesIO('<p>eggs</p>')
+        result = engine.recognize(image, 'eng', details=text_zones.TEXT_DETAILS_CHARACTER)
+        assert_equal(result.format, 'html')
+
+    def test_recognize_tsv_many(self):
+        engine = self.get_engine(use_tsv='1')
+        images = [io.BytesIO(tsv), io.BytesIO(tsv.replace('eggs', 'bacon'))]
+        results = engine.recognize_many(images, 'eng', details=text_zones.TEXT_DETAILS_WORD)
+        assert_equal(
+            [str(result) for result in results],
+            [tsv, tsv.replace('eggs', 'bacon')],
+        )
+
+    def _test_extract_zones_tsv(self, details, expected):
+        engine = self.get_engine()
+        [zone] = engine.extract_zones(io.BytesIO(tsv), details=details, page_size=(100, 50))
+        output = io.BytesIO()
+        zone.print_into(output)
+        assert_equal(output.getvalue(), expected)
+
+    def test_extract_zones_tsv_words(self):
+        self._test_extract_zones_tsv(text_zones.TEXT_DETAILS_WORD,
+            '(page 0 0 100 50 (column 10 10 90 40 (para 10 10 90 40'
+            ' (line 10 28 90 40 (word 10 28 40 40 "eggs") (word 50 28 90 39 "ham"))'
+            ' (line 10 10 60 22 (word 10 10 60 22 "spam")))))'
+        )
+
+    def test_extract_zones_tsv_lines(self):
+        self._test_extract_zones_tsv(text_zones.TEXT_DETAILS_LINE,
+            '(page 0 0 100 50 (column 10 10 90 40 (para 10 10 90 40'
+            ' (line 10 28 90 40 "eggs ham") (line 10 10 60 22 "spam"))))'
+        )
+
+    def test_recognize_many(self):
+        engine = self.get_engine()
+        images = [io.BytesIO('<p>eggs</p>'), io.BytesIO('<p>ham</p>')]
+        results = engine.recognize_many(images, 'eng', details=text_zones.TEXT_DETAILS_WORD)
+        assert_equal(
+            [str(result) for result in results],
+            [
+                "<html><body><div class='ocr_page'><p>eggs</p></div></body></html>",
+                "<html><body><div class='ocr_page'><p>ham</p></div></body></html>",
+            ]
+        )
+
+def test_split_hocr():
+    hocr = (
+        '<html><body>\n'
+        "<div class='ocr_page' id='page_1'>eggs</div>\n"
+        '<div class="ocr_page" id="page_2">ham</div>\n'
+        '</body></html>\n'
+    )
+    assert_equal(split_hocr(hocr), [
+        "<html><body>\n<div class='ocr_page' id='page_1'>eggs</div>\n</body></html>\n",
+        '<html><body>\n<div class="ocr_page" id="page_2">ham</div>\n</body></html>\n',
+    ])
+    with assert_raises(MalformedHocr):
+        split_hocr('<html><body></body></html>')
+
+def test_split_tsv():
+    pages = split_tsv(tsv + tsv.split('\n', 1)[1].replace('\t1\t', '\t2\t', 1))
+    assert_equal(pages, [tsv, tsv.replace('\t1\t', '\t2\t', 1)])
+    with assert_raises(MalformedOcrOutput):
+        split_tsv(tsv.split('\n', 2)[2])
+
+class test_tesseract_3(test_tesseract):
+
+    fake_executable = 'fake-tesseract-3'
+    version = (3, 5)
+
+    def test_version(self):
+        test_tesseract.test_version(self)
+        assert_false(self.get_engine().use_pipe)
+
+# vim:ts=4 sts=4 sw=4 et
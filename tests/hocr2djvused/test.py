@@ -27,8 +27,10 @@ from lib.cli import hocr2djvused
 
 from tests.tools import (
     assert_equal,
+    assert_less,
     assert_multi_line_equal,
     assert_not_equal,
+    assert_raises_regex,
     interim,
     sorted_glob,
     try_run,
@@ -107,6 +109,72 @@ def _rough_test_from_file(base_filename, args):
         output = output_file.getvalue()
     assert_not_equal(output, '')
 
+class ChunkedFile(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.n_read = 0
+
+    def read(self, size=-1):
+        if self.n_read >= len(self.chunks):
+            return ''
+        self.n_read += 1
+        return self.chunks[self.n_read - 1]
+
+class RecordingFile(io.BytesIO):
+
+    def __init__(self, input_file):
+        io.BytesIO.__init__(self)
+        self.input_file = input_file
+        self.n_read = []
+
+    def flush(self):
+        self.n_read += [self.input_file.n_read]
+
+def test_incremental_output():
+    head = '<html><head><meta name="ocr-system" content="tesseract 3.02"/></head><body>\n'
+    page = '<div class="ocr_page" title="bbox 0 0 100 100"><span class="ocr_line" title="bbox 1 2 30 40">{0}</span></div>\n'
+    tail = '</body></html>\n'
+    input_file = ChunkedFile([head] + [page.format(word) for word in ('eggs', 'ham', 'spam')] + [tail])
+    output_file = RecordingFile(input_file)
+    with interim(sys, stdin=input_file, stdout=output_file):
+        rc = try_run(hocr2djvused.main, ['#'])
+    assert_equal(rc, 0)
+    assert_equal(len(output_file.n_read), 3)
+    # The first page was output before the rest of the document was read.
+    assert_less(output_file.n_read[0], len(input_file.chunks))
+    assert_equal(output_file.getvalue().count('set-txt\n'), 3)
+
+def _run(args, stdin=sys.stdin):
+    stdout = io.BytesIO()
+    with interim(sys, stdin=stdin, stdout=stdout):
+        rc = try_run(hocr2djvused.main, ['#'] + args)
+    assert_equal(rc, 0)
+    return stdout.getvalue()
+
+def test_jobs():
+    paths = sorted_glob(os.path.join(here, 'alice_tesseract*.html'))
+    paths += sorted_glob(os.path.join(here, 'alice_ocropus0.3.1*.html'))
+    for args in [], ['--details=lines', '--rotation=90']:
+        expected = _run(args + paths)
+        assert_equal(expected.count('set-txt\n'), len(paths))
+        output = _run(args + ['-j', '2'] + paths)
+        assert_multi_line_equal(expected, output)
+
+def test_jobs_multi_page():
+    head = '<html><head><meta name="ocr-system" content="tesseract 3.02"/></head><body>\n'
+    page = '<div class="ocr_page" title="bbox 0 0 100 100"><span class="ocr_line" title="bbox 1 2 30 40">{0}</span></div>\n'
+    tail = '</body></html>\n'
+    document = head + str.join('', (page.format(word) for word in ('eggs', 'ham', 'spam', 'ni'))) + tail
+    expected = _run([], stdin=io.BytesIO(document))
+    assert_equal(expected.count('set-txt\n'), 4)
+    output = _run(['-j', '3'], stdin=io.BytesIO(document))
+    assert_multi_line_equal(expected, output)
+    document = head + '<div class="ocr_page">eggs</div>' + tail
+    with interim(sys, stdin=io.BytesIO(document), stdout=io.BytesIO()):
+        with assert_raises_regex(errors.MalformedHocr, '^malformed hOCR document: page without bounding box information$'):
+            hocr2djvused.main(['#', '-j', '2'])
+
 def test_from_file():
     rough_test_args = ['--details=lines']
     rough_test_args += [
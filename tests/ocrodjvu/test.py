@@ -13,19 +13,31 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import argparse
 import io
 import os
 import shutil
 import sys
 
+import djvu.decode
+import djvu.sexpr
+
 from lib import errors
+from lib import ipc
 from lib import temporary
 from lib.cli import ocrodjvu
 
 from tests.tools import (
     assert_equal,
+    assert_false,
+    assert_greater_equal,
+    assert_is,
+    assert_is_instance,
+    assert_is_none,
     assert_is_not_none,
+    assert_multi_line_equal,
     assert_not_equal,
+    assert_true,
     interim,
     remove_logging_handlers,
     require_locale_encoding,
@@ -119,4 +131,309 @@ def test_bad_page_id():
     assert_equal(rc, 0)
     assert_equal(stdout.getvalue(), '')
 
+def _save_script(path, *args):
+    remove_logging_handlers('ocrodjvu.')
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    with temporary.directory() as tmpdir:
+        script_path = os.path.join(tmpdir, 'tmp.djvused')
+        with interim(sys, stdout=stdout, stderr=stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--save-script', script_path] + list(args) + [path])
+        assert_equal(stderr.getvalue(), '')
+        assert_equal(rc, 0)
+        assert_equal(stdout.getvalue(), '')
+        with open(script_path, 'rb') as file:
+            return file.read()
+
+def test_workers_process():
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    expected = _save_script(path)
+    script = _save_script(path, '-j', '2', '--workers=process')
+    assert_multi_line_equal(expected, script)
+
+def test_batch_size():
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    expected = _save_script(path)
+    script = _save_script(path, '-j', '2', '--batch-size', '2')
+    assert_multi_line_equal(expected, script)
+
+class _page(object):
+
+    def __init__(self, n):
+        self.n = n
+        self.file = argparse.Namespace(id='p{n:04}.djvu'.format(n=(n + 1)))
+
+def test_batch_retry():
+    calls = []
+    class context_type(ocrodjvu.Context):
+        def process_pages_serialized(self, job, pages):
+            calls.append([page.n for page in pages])
+            # The second page failed:
+            return ['(page 0 0 1 1 "eggs")', None, False]
+        def process_page_serialized(self, job, page):
+            calls.append(page.n)
+            return '(page 0 0 1 1 "ham")'
+    context = context_type()
+    context._journal = ocrodjvu.NullJournal()
+    job = ocrodjvu.DocumentJob('eggs.djvu', None, [], None)
+    scheduler = ocrodjvu.Scheduler(1)
+    futures = scheduler.submit(job, [_page(n) for n in range(3)])
+    scheduler.close()
+    context.page_thread(scheduler)
+    # Only the failed page is processed again:
+    assert_equal(calls, [[0, 1, 2], 1])
+    assert_equal(
+        [future.result() for future in futures],
+        ['(page 0 0 1 1 "eggs")', '(page 0 0 1 1 "ham")', False],
+    )
+
+def test_scheduler_reserve():
+    scheduler = ocrodjvu.Scheduler(1, memory_budget=10)
+    assert_true(scheduler.reserve(6))
+    assert_false(scheduler.reserve(5))
+    assert_true(scheduler.reserve(4))
+    assert_false(scheduler.reserve(1))
+    scheduler.release(6)
+    assert_true(scheduler.reserve(5))
+    assert_false(scheduler.reserve(2))
+    scheduler = ocrodjvu.Scheduler(1)
+    assert_true(scheduler.reserve(1 << 40))
+
+def test_scheduler_has_room():
+    scheduler = ocrodjvu.Scheduler(1, max_inflight=4)
+    assert_true(scheduler.has_room(0, 1))
+    assert_true(scheduler.has_room(2, 2))
+    assert_false(scheduler.has_room(2, 3))
+    assert_false(scheduler.has_room(4, 1))
+    # A batch larger than the limit is submitted when nothing else is in flight:
+    assert_true(scheduler.has_room(0, 10))
+    scheduler = ocrodjvu.Scheduler(1)
+    assert_true(scheduler.has_room(100, 100))
+
+def test_spill_result():
+    text = '(page 0 0 1 1 "\xff")'
+    context = ocrodjvu.Context()
+    context._journal = ocrodjvu.NullJournal()
+    with temporary.directory() as tmpdir:
+        job = ocrodjvu.DocumentJob('eggs.djvu', None, [], tmpdir)
+        result = context.spill_result(job, 0, text)
+        assert_is_instance(result, ocrodjvu.SpilledResult)
+        assert_equal(result.read(), text)
+        # Results that don't fit in the memory budget are spilled to disk:
+        scheduler = ocrodjvu.Scheduler(1, memory_budget=len(text))
+        [future1, future2] = scheduler.submit(job, [_page(1), _page(2)])
+        context.finish_page(scheduler, future1, text)
+        assert_equal(future1.result(), text)
+        context.finish_page(scheduler, future2, text)
+        result = future2.result()
+        assert_is_instance(result, ocrodjvu.SpilledResult)
+        assert_equal(result.read(), text)
+
+def test_journal():
+    with temporary.directory() as tmpdir:
+        path = os.path.join(tmpdir, 'journal')
+        eggs_path = os.path.join(tmpdir, 'eggs.djvu')
+        ham_path = os.path.join(tmpdir, 'ham.djvu')
+        for djvu_path in eggs_path, ham_path:
+            with open(djvu_path, 'wb') as file:
+                file.write('AT&TFORM')
+        journal = ocrodjvu.Journal(path, 'spam')
+        assert_is_none(journal.get(eggs_path, 'p0001.djvu'))
+        journal.record(eggs_path, 'p0001.djvu', '(page 0 0 1 1 "\xc5\xbc\xff")')
+        journal.record(eggs_path, 'p0002.djvu', False)
+        journal.close()
+        with open(path, 'ab') as file:
+            # truncated entry
+            file.write('{"document": "eggs.djvu", "id": "p0003.djvu", "fing')
+        journal = ocrodjvu.Journal(path, 'spam')
+        assert_equal(journal.get(eggs_path, 'p0001.djvu'), '(page 0 0 1 1 "\xc5\xbc\xff")')
+        assert_is(journal.get(eggs_path, 'p0002.djvu'), False)
+        assert_is_none(journal.get(eggs_path, 'p0003.djvu'))
+        assert_is_none(journal.get(ham_path, 'p0001.djvu'))
+        # New entries are not glued to the truncated one.
+        journal.record(eggs_path, 'p0003.djvu', '(page 0 0 1 1 "ham")')
+        journal.close()
+        journal = ocrodjvu.Journal(path, 'spam')
+        assert_equal(journal.get(eggs_path, 'p0001.djvu'), '(page 0 0 1 1 "\xc5\xbc\xff")')
+        assert_equal(journal.get(eggs_path, 'p0003.djvu'), '(page 0 0 1 1 "ham")')
+        # The same file can be given by different paths.
+        alt_path = os.path.join(tmpdir, '.', 'eggs.djvu')
+        assert_equal(journal.get(alt_path, 'p0001.djvu'), '(page 0 0 1 1 "\xc5\xbc\xff")')
+        journal.close()
+        journal = ocrodjvu.Journal(path, 'ham')
+        assert_is_none(journal.get(eggs_path, 'p0001.djvu'))
+        journal.close()
+        # Results for a modified file are not reused.
+        os.utime(eggs_path, (0, 0))
+        journal = ocrodjvu.Journal(path, 'spam')
+        assert_is_none(journal.get(eggs_path, 'p0001.djvu'))
+        journal.close()
+
+def test_resume():
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    expected = _save_script(path)
+    with temporary.directory() as tmpdir:
+        journal_path = os.path.join(tmpdir, 'journal')
+        script = _save_script(path, '--resume', journal_path)
+        assert_multi_line_equal(expected, script)
+        script = _save_script(path, '--resume', journal_path)
+        assert_multi_line_equal(expected, script)
+
+def test_resume_memory_budget():
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    sizes = []
+    class scheduler_type(ocrodjvu.Scheduler):
+        def reserve(self, size):
+            try:
+                return super(scheduler_type, self).reserve(size)
+            finally:
+                sizes.append(self._size)
+        def release(self, size):
+            super(scheduler_type, self).release(size)
+            sizes.append(self._size)
+        def close(self):
+            super(scheduler_type, self).close()
+            sizes.append(self._size)
+    expected = _save_script(path)
+    with temporary.directory() as tmpdir:
+        journal_path = os.path.join(tmpdir, 'journal')
+        with interim(ocrodjvu, Scheduler=scheduler_type):
+            for i in range(2):
+                # The second run replays the results from the journal.
+                del sizes[:]
+                script = _save_script(path, '--resume', journal_path, '--memory-budget', '1M')
+                assert_multi_line_equal(expected, script)
+                assert_greater_equal(min(sizes), 0)
+                assert_equal(sizes[-1], 0)
+
+def test_skip_existing_text():
+    remove_logging_handlers('ocrodjvu.')
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    with temporary.directory() as tmpdir:
+        tmp_path = os.path.join(tmpdir, 'tmp.djvu')
+        shutil.copy(path, tmp_path)
+        expected = _save_script(tmp_path)
+        script = _save_script(tmp_path, '--skip-existing-text')
+        assert_multi_line_equal(expected, script)
+        djvused_path = os.path.join(tmpdir, 'tmp.djvused')
+        with open(djvused_path, 'wb') as file:
+            file.write('select 1\nset-txt\n(page 0 0 1 1 "eggs")\n.\n')
+        ipc.Subprocess(['djvused', '-f', djvused_path, '-s', tmp_path]).wait()
+        script = _save_script(tmp_path, '--skip-existing-text')
+        assert_multi_line_equal(expected.split('.\n\n', 1)[1], script)
+        with interim(sys, stdout=stdout, stderr=stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--dry-run', '--clear-text', '--skip-existing-text', tmp_path])
+        assert_equal(rc, errors.EXIT_FATAL)
+        assert_not_equal(stderr.getvalue(), '')
+
+class _page_text(object):
+
+    def __init__(self, sexpr):
+        self._sexpr = sexpr
+
+    def wait(self):
+        pass
+
+    @property
+    def sexpr(self):
+        if isinstance(self._sexpr, type):
+            raise self._sexpr
+        return djvu.sexpr.Expression.from_string(self._sexpr)
+
+def test_has_text():
+    def t(sexpr):
+        page = argparse.Namespace(text=_page_text(sexpr))
+        return ocrodjvu.has_text(page)
+    assert_true(t('(page 0 0 1 1 (line 0 0 1 1 "eggs"))'))
+    assert_false(t('(page 0 0 1 1 (line 0 0 1 1 " "))'))
+    assert_false(t('(page 0 0 1 1 "")'))
+    assert_false(t('()'))
+    # Pages whose text cannot be decoded are treated as having no text:
+    assert_false(t(djvu.decode.JobFailed))
+    assert_false(t(djvu.decode.NotAvailable))
+
+def test_multiple_files():
+    remove_logging_handlers('ocrodjvu.')
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    with temporary.directory() as tmpdir:
+        paths = []
+        for name in 'eggs.djvu', 'ham.djvu':
+            tmp_path = os.path.join(tmpdir, name)
+            shutil.copy(path, tmp_path)
+            paths += [tmp_path]
+        with interim(sys, stdout=stdout, stderr=stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '-j', '2', '--dry-run'] + paths)
+        assert_equal(stderr.getvalue(), '')
+        assert_equal(rc, 0)
+        assert_equal(stdout.getvalue(), '')
+        with interim(sys, stdout=stdout, stderr=stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--save-script', os.path.join(tmpdir, 'tmp.djvused')] + paths)
+        assert_equal(rc, errors.EXIT_FATAL)
+        assert_not_equal(stderr.getvalue(), '')
+
+def test_multiple_files_error():
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    with temporary.directory() as tmpdir:
+        paths = []
+        for name in 'eggs.djvu', 'ham.djvu':
+            tmp_path = os.path.join(tmpdir, name)
+            shutil.copy(path, tmp_path)
+            paths += [tmp_path]
+        paths[1:1] = [os.path.join(tmpdir, 'nonexistent.djvu')]
+        with interim(sys, stdout=stdout, stderr=stderr):
+            with interim(ocrodjvu.logger, handlers=[]):
+                rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '-j', '2', '--dry-run', '--on-error=resume'] + paths)
+    # The other files were processed anyway.
+    assert_equal(rc, errors.EXIT_NONFATAL)
+    assert_equal(stdout.getvalue(), '')
+
+def _print_text(path):
+    djvused = ipc.Subprocess(['djvused', '-e', 'print-txt', path], stdout=ipc.PIPE)
+    try:
+        return djvused.stdout.read()
+    finally:
+        djvused.wait()
+
+def test_stream_save():
+    remove_logging_handlers('ocrodjvu.')
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    stdout = io.BytesIO()
+    stderr = io.BytesIO()
+    with temporary.directory() as tmpdir:
+        texts = []
+        for args in [], ['--stream-save']:
+            tmp_path = os.path.join(tmpdir, 'tmp.djvu')
+            shutil.copy(path, tmp_path)
+            with interim(sys, stdout=stdout, stderr=stderr):
+                rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '-j', '2', '--in-place'] + args + [tmp_path])
+            assert_equal(stderr.getvalue(), '')
+            assert_equal(rc, 0)
+            assert_equal(stdout.getvalue(), '')
+            texts += [_print_text(tmp_path)]
+    [expected, text] = texts
+    assert_not_equal(expected, '')
+    assert_multi_line_equal(expected, text)
+
 # vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,89 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import io
+import os
+
+from tests.tools import (
+    assert_equal,
+    assert_is_none,
+    assert_not_equal,
+    assert_true,
+)
+
+from lib import cache
+from lib import temporary
+from lib.engines import common
+
+def test_get_key():
+    image = io.BytesIO('eggs')
+    key = cache.get_key(image, 'tesseract', 'eng')
+    assert_equal(key, cache.get_key(image, 'tesseract', 'eng'))
+    assert_not_equal(key, cache.get_key(image, 'tesseract', 'pol'))
+    assert_not_equal(key, cache.get_key(io.BytesIO('ham'), 'tesseract', 'eng'))
+
+class test_cache():
+
+    def test_get_put(self):
+        with temporary.directory() as tmpdir:
+            c = cache.Cache(tmpdir)
+            assert_is_none(c.get('0123456789'))
+            c.put('0123456789', common.Output('<html>\neggs\n</html>', format='html'))
+            result = c.get('0123456789')
+            assert_equal(result.format, 'html')
+            assert_equal(str(result), '<html>\neggs\n</html>')
+            c = cache.Cache(tmpdir)
+            result = c.get('0123456789')
+            assert_equal(str(result), '<html>\neggs\n</html>')
+
+    def test_eviction(self):
+        with temporary.directory() as tmpdir:
+            c = cache.Cache(tmpdir, max_size=20)
+            c.put('0123456789', common.Output('eggs', format='txt'))
+            c.put('1234567890', common.Output('ham', format='txt'))
+            os.utime(c._get_path('0123456789'), (0, 0))
+            c = cache.Cache(tmpdir, max_size=20)
+            c.put('2345678901', common.Output('spam', format='txt'))
+            assert_is_none(c.get('0123456789'))
+            assert_equal(str(c.get('1234567890')), 'ham')
+            assert_equal(str(c.get('2345678901')), 'spam')
+
+    def test_eviction_in_memory(self):
+        with temporary.directory() as tmpdir:
+            c = cache.Cache(tmpdir, max_size=100)
+            scans = []
+            scan = c._scan
+            def counting_scan():
+                scans.append(None)
+                return scan()
+            c._scan = counting_scan
+            keys = ['{0:010}'.format(i) for i in range(30)]
+            for key in keys:
+                # Each entry takes 10 bytes.
+                c.put(key, common.Output('eggs' + key[-2:], format='txt'))
+                c.get(keys[0])
+            assert_equal(len(scans), 1)
+            # The most recently used entries are kept:
+            assert_equal(str(c.get(keys[0])), 'eggs00')
+            assert_equal(str(c.get(keys[-1])), 'eggs29')
+            assert_is_none(c.get(keys[1]))
+            sizes = [
+                os.path.getsize(os.path.join(root, name))
+                for root, dirs, files in os.walk(tmpdir)
+                for name in files
+            ]
+            assert_true(sum(sizes) <= 100)
+
+# vim:ts=4 sts=4 sw=4 et
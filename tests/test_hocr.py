@@ -0,0 +1,57 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+from tests.tools import (
+    assert_equal,
+    assert_less,
+    assert_raises,
+)
+
+from lib import errors
+from lib import hocr
+
+class ChunkedFile(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.n_read = 0
+
+    def read(self, size=-1):
+        if self.n_read >= len(self.chunks):
+            return ''
+        self.n_read += 1
+        return self.chunks[self.n_read - 1]
+
+head = '<html><head><meta name="ocr-system" content="tesseract 3.02"/></head><body>\n'
+page = '<div class="ocr_page" title="bbox 0 0 100 100"><span class="ocr_line" title="bbox 1 2 30 40">{0}</span></div>\n'
+tail = '</body></html>\n'
+
+def test_iterscan():
+    file = ChunkedFile([head] + [page.format(word) for word in ('eggs', 'ham', 'spam')] + [tail])
+    settings = hocr.ExtractSettings()
+    zones = hocr.iterscan(hocr.iterparse_document(file, settings), settings)
+    zone = next(zones)
+    assert_less(file.n_read, len(file.chunks))
+    assert_equal(zone.sexpr.as_string(), '(page 0 0 100 100 (line 1 60 30 98 "eggs"))')
+    assert_equal(len(list(zones)), 2)
+
+def test_iterscan_text():
+    file = ChunkedFile([head, page.format('eggs'), 'ham', tail])
+    settings = hocr.ExtractSettings()
+    zones = hocr.iterscan(hocr.iterparse_document(file, settings), settings)
+    with assert_raises(errors.MalformedHocr):
+        list(zones)
+
+# vim:ts=4 sts=4 sw=4 et
@@ -22,6 +22,7 @@ import signal
 from tests.tools import (
     assert_equal,
     assert_false,
+    assert_is_none,
     assert_raises,
     assert_true,
     interim_environ,
@@ -200,4 +201,14 @@ class test_require():
         )
         assert_equal(str(ecm.exception), exc_message)
 
+class test_which():
+
+    def test_ok(self):
+        path = ipc.which('cat')
+        assert_equal(os.path.basename(path), 'cat')
+        assert_equal(ipc.which(path), path)
+
+    def test_fail(self):
+        assert_is_none(ipc.which('ocrodjvu-nonexistent'))
+
 # vim:ts=4 sts=4 sw=4 et
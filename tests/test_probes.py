@@ -0,0 +1,111 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import os
+import stat
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_raises_regex,
+    interim_environ,
+)
+
+from lib import errors
+from lib import probes
+from lib import temporary
+
+def make_executable(path, contents):
+    with open(path, 'wb') as file:
+        file.write(contents)
+    os.chmod(path, stat.S_IRWXU)
+
+class test_probe_cache():
+
+    def test_call(self):
+        calls = []
+        def probe(n):
+            calls.append(n)
+            return ('eggs', n)
+        with temporary.directory() as tmpdir:
+            executable = os.path.join(tmpdir, 'ham')
+            make_executable(executable, '#!/bin/sh\n')
+            path = os.path.join(tmpdir, 'cache', 'probes.json')
+            cache = probes.ProbeCache(path)
+            assert_equal(cache.call(executable, 'spam', probe, 42), ['eggs', 42])
+            assert_equal(cache.call(executable, 'spam', probe, 42), ['eggs', 42])
+            assert_equal(calls, [42])
+            cache = probes.ProbeCache(path)
+            assert_equal(cache.call(executable, 'spam', probe, 42), ['eggs', 42])
+            assert_equal(cache.call(executable, 'spam', probe, 37), ['eggs', 37])
+            assert_equal(calls, [42, 37])
+            # The executable was upgraded:
+            make_executable(executable, '#!/bin/sh\nexit 0\n')
+            assert_equal(cache.call(executable, 'spam', probe, 42), ['eggs', 42])
+            assert_equal(calls, [42, 37, 42])
+
+    def test_call_error(self):
+        calls = []
+        def probe():
+            calls.append(None)
+            raise errors.EngineNotFound('ham')
+        with temporary.directory() as tmpdir:
+            executable = os.path.join(tmpdir, 'ham')
+            make_executable(executable, '#!/bin/sh\n')
+            path = os.path.join(tmpdir, 'probes.json')
+            for i in range(2):
+                cache = probes.ProbeCache(path)
+                with assert_raises_regex(errors.EngineNotFound, r'^OCR engine \(ham\) was not found$'):
+                    cache.call(executable, 'spam', probe)
+            assert_equal(len(calls), 1)
+
+    def test_call_disabled(self):
+        calls = []
+        def probe():
+            calls.append(None)
+            return 'eggs'
+        with temporary.directory() as tmpdir:
+            executable = os.path.join(tmpdir, 'ham')
+            make_executable(executable, '#!/bin/sh\n')
+            path = os.path.join(tmpdir, 'probes.json')
+            cache = probes.ProbeCache(path)
+            with interim_environ(OCRODJVU_PROBE_CACHE='0'):
+                for i in range(2):
+                    assert_equal(cache.call(executable, 'spam', probe), 'eggs')
+            assert_equal(len(calls), 2)
+            assert_false(os.path.exists(path))
+
+    def test_call_not_found(self):
+        with temporary.directory() as tmpdir:
+            cache = probes.ProbeCache(os.path.join(tmpdir, 'probes.json'))
+            executable = os.path.join(tmpdir, 'ham')
+            for i in range(2):
+                assert_equal(cache.call(executable, 'spam', lambda: i), i)
+            assert_equal(os.listdir(tmpdir), [])
+
+def test_get_path():
+    with interim_environ(XDG_CACHE_HOME='/eggs'):
+        assert_equal(probes.get_path(), '/eggs/ocrodjvu/probes.json')
+
+def test_run_parallel():
+    assert_equal(probes.run_parallel([]), [])
+    assert_equal(probes.run_parallel([lambda: 'eggs']), ['eggs'])
+    assert_equal(probes.run_parallel([lambda: 'eggs', lambda: 'ham']), ['eggs', 'ham'])
+    def fail(message):
+        raise ValueError(message)
+    with assert_raises_regex(ValueError, '^eggs$'):
+        probes.run_parallel([lambda: 'spam', lambda: fail('eggs'), lambda: fail('ham')])
+
+# vim:ts=4 sts=4 sw=4 et
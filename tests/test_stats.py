@@ -0,0 +1,80 @@
+# encoding=UTF-8
+
+# Copyright © 2022 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+import json
+import os
+
+from tests.tools import (
+    assert_equal,
+    assert_in,
+)
+
+from lib import stats
+from lib import temporary
+
+def test_percentile():
+    values = range(1, 101)
+    assert_equal(stats.percentile(values, 50), 50)
+    assert_equal(stats.percentile(values, 90), 90)
+    assert_equal(stats.percentile(values, 99), 99)
+    assert_equal(stats.percentile([7], 50), 7)
+
+def test_timer():
+    with temporary.directory() as tmpdir:
+        path = os.path.join(tmpdir, 'stats')
+        s = stats.Stats(path)
+        with stats.timer('eggs'):
+            # no page context, nothing recorded
+            pass
+        with stats.pages(s, 'doc.djvu', [1, 2]):
+            with stats.timer('ham'):
+                pass
+            with stats.subset([2]):
+                with stats.timer('spam'):
+                    pass
+        with stats.pages(s, 'doc.djvu', None):
+            with stats.timer('save'):
+                pass
+        s.close()
+        with open(path, 'rb') as file:
+            records = [json.loads(line) for line in file]
+        assert_equal(
+            [(r['stage'], r['document'], r['page']) for r in records],
+            [
+                ('ham', 'doc.djvu', 1),
+                ('ham', 'doc.djvu', 2),
+                ('spam', 'doc.djvu', 2),
+                ('save', 'doc.djvu', None),
+            ]
+        )
+        summary = stats.summarize(path)
+        assert_equal([item['stage'] for item in summary], ['ham', 'save', 'spam'])
+        assert_equal([item['count'] for item in summary], [2, 1, 1])
+
+def test_prometheus():
+    summary = [
+        dict(stage='ocr', count=2, total=3.0, p50=1.0, p90=2.0, p99=2.0, max=2.0),
+    ]
+    with temporary.directory() as tmpdir:
+        path = os.path.join(tmpdir, 'ocrodjvu.prom')
+        stats.write_prometheus(summary, path)
+        with open(path, 'rb') as file:
+            lines = file.read().splitlines()
+    assert_in('# TYPE ocrodjvu_stage_seconds summary', lines)
+    assert_in('ocrodjvu_stage_seconds{stage="ocr",quantile="0.5"} 1.0', lines)
+    assert_in('ocrodjvu_stage_seconds_sum{stage="ocr"} 3.0', lines)
+    assert_in('ocrodjvu_stage_seconds_count{stage="ocr"} 2', lines)
+
+# vim:ts=4 sts=4 sw=4 et
@@ -16,14 +16,19 @@
 import io
 import distutils.version
 
+import djvu.decode
+
 from tests.tools import (
     assert_equal,
+    assert_false,
+    assert_true,
+    interim,
 )
 
 from lib import text_zones
 
 V = distutils.version.LooseVersion
-python_djvulibre_version = V(text_zones.decode.__version__)
+python_djvulibre_version = V(djvu.decode.__version__)
 
 def test_print_sexpr():
     inp = 'jeż'
@@ -37,4 +42,98 @@ def test_print_sexpr():
     fp.seek(0)
     assert_equal(fp.getvalue(), out)
 
+def test_print_into():
+    const = text_zones.const
+    zone = text_zones.Zone(const.TEXT_ZONE_PAGE, (0, 0, 100, 50), [
+        text_zones.Zone(const.TEXT_ZONE_LINE, (10, 20, 10, 20), [
+            text_zones.Zone(const.TEXT_ZONE_WORD, (10, 20, 30, 40), ['"ja\\\tjeż\x01"']),
+            text_zones.Space(),
+            text_zones.Zone(const.TEXT_ZONE_WORD, (10, 20, 30, 40), []),
+        ]),
+    ])
+    if python_djvulibre_version < V('0.4'):
+        s = r'"\"ja\\\tje\305\274\001\""'
+    else:
+        s = r'"\"ja\\\tjeż\001\""'
+    out = '(page 0 0 100 50 (line 10 20 11 21 (word 10 20 30 40 {s}) (word 10 20 30 40 "")))'.format(s=s)
+    fp = io.BytesIO()
+    zone.print_into(fp)
+    assert_equal(fp.getvalue(), out)
+
+def test_print_into_width():
+    const = text_zones.const
+    zone = text_zones.Zone(const.TEXT_ZONE_PAGE, (0, 0, 100, 50), [
+        text_zones.Zone(const.TEXT_ZONE_LINE, (10, 20, 11, 21), [
+            text_zones.Zone(const.TEXT_ZONE_WORD, (10, 20, 30, 40), ['eggs']),
+            text_zones.Zone(const.TEXT_ZONE_WORD, (10, 20, 30, 40), ['ham']),
+        ]),
+    ])
+    out = (
+        '(page 0 0 100 50 \n'
+        '  (line 10 20 11 21 (word 10 20 30 40 "eggs") \n'
+        '    (word 10 20 30 40 "ham") ) )'
+    )
+    fp = io.BytesIO()
+    zone.print_into(fp, width=50)
+    assert_equal(fp.getvalue(), out)
+    out = '(page 0 0 100 50 (line 10 20 11 21 (word 10 20 30 40 "eggs") (word 10 20 30 40 "ham")))'
+    fp = io.BytesIO()
+    zone.print_into(fp, width=100)
+    assert_equal(fp.getvalue(), out)
+
+def _rotate_point(point, rotation, page_size):
+    if (rotation // 90) & 1:
+        xform = djvu.decode.AffineTransform((0, 0) + tuple(reversed(page_size)), (0, 0) + page_size)
+    else:
+        xform = djvu.decode.AffineTransform((0, 0) + page_size, (0, 0) + page_size)
+    xform.mirror_y()
+    xform.rotate(rotation)
+    return xform.inverse(point)
+
+def test_rotate():
+    const = text_zones.const
+    page_size = (100, 50)
+    bbox = (10, 20, 30, 40)
+    for rotation in (0, 90, 180, 270, -90, 450):
+        word = text_zones.Zone(const.TEXT_ZONE_WORD, bbox, ['eggs'])
+        page = text_zones.Zone(const.TEXT_ZONE_PAGE, (0, 0) + page_size, [word])
+        page.rotate(rotation)
+        x0, y0 = _rotate_point(bbox[:2], rotation, page_size)
+        x1, y1 = _rotate_point(bbox[2:], rotation, page_size)
+        assert_equal(word.bbox, (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)))
+        assert_equal(page.bbox, (0, 0) + (page_size[::-1] if (rotation // 90) & 1 else page_size))
+
+def _test_get_bboxes():
+    coordinates = [(1, 2, 3, 4), (0, 5, 2, 6), (9, 9, 9, 9), (4, 1, 5, 3), (2, 2, 8, 8)]
+    spans = [(0, 2), (3, 4), (4, 5)]
+    bboxes = text_zones.get_bboxes(coordinates, spans)
+    assert_equal(map(tuple, bboxes), [(0, 2, 3, 6), (4, 1, 5, 3), (2, 2, 8, 8)])
+    bboxes = text_zones.get_bboxes(coordinates, [(1, 3)])
+    assert_equal(map(tuple, bboxes), [(0, 5, 9, 9)])
+    coordinates = [(1, None, 3, 4), (0, 5, 2, 6)]
+    bboxes = text_zones.get_bboxes(coordinates, [(0, 2)])
+    assert_equal(map(tuple, bboxes), [(0, 5, 3, 6)])
+    assert_equal(text_zones.get_bboxes(coordinates, []), [])
+
+def test_get_bboxes():
+    _test_get_bboxes()
+
+def test_get_bboxes_without_numpy():
+    with interim(text_zones, numpy=None):
+        _test_get_bboxes()
+
+def test_bbox():
+    bbox = text_zones.BBox()
+    assert_false(bbox)
+    bbox.update((5, 6, 7, 8))
+    assert_true(bbox)
+    bbox.update(text_zones.BBox(1, 7, 9, 7))
+    bbox.update((None, 2, None, None))
+    assert_equal(tuple(bbox), (1, 2, 9, 8))
+    assert_equal((bbox.x0, bbox.y0, bbox.x1, bbox.y1), (1, 2, 9, 8))
+    assert_equal(bbox[2:], (9, 8))
+    assert_equal(repr(bbox), 'BBox(1, 2, 9, 8)')
+    zone = text_zones.Zone(text_zones.const.TEXT_ZONE_WORD, bbox, ['eggs'])
+    assert_equal(zone.bbox, (1, 2, 9, 8))
+
 # vim:ts=4 sts=4 sw=4 et
@@ -15,13 +15,16 @@
 
 from tests.tools import (
     assert_equal,
+    assert_is,
     assert_not_equal,
 )
 
 from lib.unicode_support import (
     get_icu,
+    get_locale,
     simple_word_break_iterator,
     word_break_iterator,
+    word_breaks,
 )
 
 text = u'\u201CJekyll,\u201D cried Utterson, with a\xa0loud voice, \u201CI demand to see you.\u201D'
@@ -72,4 +75,28 @@ class test_word_break_iterator():
         t = list(word_break_iterator('', icu.Locale('en')))
         assert_equal(t, [])
 
+def test_get_locale():
+    locale = get_locale('en')
+    assert_equal(locale.getName(), 'en')
+    assert_is(get_locale('en'), locale)
+    assert_equal(get_locale(True).getName(), 'en_US_POSIX')
+
+class test_word_breaks():
+
+    texts = [text, u'', u'eggs\U0001F95A ham', u' spam ']
+
+    def _test(self, locale):
+        assert_equal(
+            word_breaks(self.texts, locale),
+            [list(word_break_iterator(t, locale)) for t in self.texts]
+        )
+        assert_equal(word_breaks([], locale), [])
+
+    def test_nolocale(self):
+        self._test(None)
+
+    def test_en(self):
+        icu = get_icu()
+        self._test(icu.Locale('en'))
+
 # vim:ts=4 sts=4 sw=4 et
@@ -38,6 +38,7 @@ from lib.utils import (
     identity,
     not_overridden,
     parse_page_numbers,
+    parse_size,
     property,
     sanitize_utf8,
     smart_repr,
@@ -143,6 +144,23 @@ class test_parse_page_numbers():
     def test_collapsed_range(self):
         assert_equal(parse_page_numbers('17-17'), [17])
 
+class test_parse_size():
+
+    def test_bytes(self):
+        assert_equal(parse_size('42'), 42)
+
+    def test_suffixes(self):
+        assert_equal(parse_size('42k'), 42 << 10)
+        assert_equal(parse_size('42K'), 42 << 10)
+        assert_equal(parse_size('42M'), 42 << 20)
+        assert_equal(parse_size('1G'), 1 << 30)
+
+    def test_bad(self):
+        with assert_raises(ValueError):
+            parse_size('42x')
+        with assert_raises(ValueError):
+            parse_size('M')
+
 class test_sanitize_utf8():
 
     def test_control_characters(self):